@@ -4,12 +4,12 @@
 import os, json, logging
 from os import environ as env
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate, init, migrate, upgrade
+from flask_migrate import Migrate
 from flask_cors import CORS
 # from flask_jwt_extended import JWTManager
 # from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv
+from .db_routing import RoutingSQLAlchemy
 
 # load env
 load_dotenv()
@@ -18,57 +18,30 @@ load_dotenv()
 APP_ENV = env.get('GAE_ENV', '')
 CORS_ORIGINS_LIST = env.get('CORS_ORIGINS_LIST', '').split(',')
 
-# middlewares
-db = SQLAlchemy()
+# pre-built migrations, see schema.py
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+# middlewares, reads go to replicas when configured, see db_routing.py
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 cors = CORS()
 
 # configure logging
 def setup_logging():
   """
-  setup for logging, should move to a separate file or .conf file
+  setup for logging, records are queued and written by a background thread, see log_pipeline.py
   """
-  # dir for logs
-  if APP_ENV.startswith('standard'):
-    # gcloud production environment, use google cloud logging
-    import google.cloud.logging
-    from google.cloud.logging.handlers import CloudLoggingHandler, setup_logging
-    
-    client = google.cloud.logging.Client()
-    handler = CloudLoggingHandler(client)
-    logging.getLogger().setLevel(logging.INFO) # python root logger
-    setup_logging(handler)
-  else:
-    # dev env, log to file
-    root = os.path.dirname(os.path.abspath(__file__))
-    logdir = os.path.join(root, env.get('LOG_DIR', 'logs'))
-    if not os.path.exists(logdir):
-      os.mkdir(logdir)
-    log_file = os.path.join(logdir, env.get('LOG_FILE', 'app.log'))
-  
-    # configure formatters
-    detailed_format = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s - %(funcName)s - %(message)s')
-    simple_format = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(message)s')
-    
-    # configure handlers
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(detailed_format)
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(logging.INFO)
-    stream_handler.setFormatter(simple_format)
-    
-    # configure logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+  from .log_pipeline import setup_logging as setup_log_pipeline
+  
+  setup_log_pipeline(APP_ENV)
   
 
 # configure firebase
-def setup_firebase():
+def setup_firebase(http_timeout: float|None = None):
   """_summary_
     configure firebase with credential from env
+  Args:
+      http_timeout (float|None): seconds before a firebase admin api call gives up, firebase's default if None
   Returns:
       _type_: firebase app
   """
@@ -78,27 +51,31 @@ def setup_firebase():
   gcred = env.get('GCLOUD_APP_CRED', None)
   if gcred is not None:
     cred = credentials.Certificate(json.loads(gcred))
-  default_fb_app = firebase_admin.initialize_app(cred if gcred is not None else None)
+  options = {'httpTimeout': http_timeout} if http_timeout else None
+  default_fb_app = firebase_admin.initialize_app(cred if gcred is not None else None, options)
   return default_fb_app
 
 
 # configure db migrations
-def migrate_db():
-  """_summary_
-    migrate db
+def migrate_db(app: Flask) -> bool:
   """
-  init(directory='/tmp/migrations')
-  migrate(directory='/tmp/migrations')
-  upgrade(directory='/tmp/migrations')
+    bring the db to the head of the shipped migrations, a revision check when already there
+    see schema.py
+  """
+  from .schema import ensure_schema
+  
+  return ensure_schema(app, app.config.get('MIGRATIONS_DIR') or MIGRATIONS_DIR,
+    app.config.get('MIGRATE_LOCK_TIMEOUT', 60))
 
 
 # flask function factory
 def create_app(config_name: str|None = None) -> Flask:
+  from .startup import startup_report
+  
   # configure logging
-  setup_logging()
-  # firebase
-  setup_firebase()
-  # create app
+  with startup_report.phase('logging'):
+    setup_logging()
+  # create app, firebase is initialized on warmup or the first request, see startup.py
   app = Flask(__name__)
   # get config
   if APP_ENV.startswith('standard'):
@@ -117,24 +94,78 @@ def create_app(config_name: str|None = None) -> Flask:
     # dev env
     app.config.from_object('configs.development')
   
+  # instrument the connection pool
+  from .db_pool import InstrumentedQueuePool
+  
+  engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+  if 'pool_size' in engine_options:
+    engine_options.setdefault('poolclass', InstrumentedQueuePool)
+  
+  # json encoding backend
+  from . import fast_json
+  
+  fast_json.init_app(app)
+  
   # initialize middlewares
   db.init_app(app)
-  migrate.init_app(app, db)
+  
+  from . import db_routing
+  
+  db_routing.init_app(app, db)
+  migrate.init_app(app, db, directory=app.config.get('MIGRATIONS_DIR') or MIGRATIONS_DIR)
   cors.init_app(app, resources={r"/api/*": {
     "origins": CORS_ORIGINS_LIST,
     "supports_credentials": True,
   }})
   
+  if app.config.get('MIGRATE_ON_STARTUP', False):
+    with startup_report.phase('migrations'):
+      migrate_db(app)
+  
   # initialize blueprints
-  from .auth.controllers.role import role_bp
-  from .auth.controllers.auth import auth_bp
+  with startup_report.phase('blueprints'):
+    from .auth.controllers.role import role_bp
+    from .auth.controllers.auth import auth_bp
+    from .auth.controllers.user import user_bp
+    
+    app.register_blueprint(role_bp, url_prefix='/api/role')
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(user_bp, url_prefix='/api/user')
+  
+  # deferred firebase setup and /_ah/warmup
+  from . import startup
+  
+  with startup_report.phase('startup_hooks'):
+    startup.init_app(app)
+  
+  # configure caches
+  from .auth.controllers import init_session_cache, init_token_guards, init_revocation_index
+  
+  init_session_cache(app.config.get('SESSION_CACHE_MAX_SIZE', 1024), app.config.get('SESSION_CACHE_TTL', 300))
+  init_token_guards(app.config.get('NEGATIVE_CACHE_MAX_SIZE', 4096), app.config.get('NEGATIVE_CACHE_TTL', 300),
+    app.config.get('RATE_LIMIT_PER_SECOND', 5), app.config.get('RATE_LIMIT_BURST', 20),
+    app.config.get('RATE_LIMIT_MAX_CLIENTS', 10000))
+  init_revocation_index(app.config.get('REVOCATION_REFRESH_INTERVAL', 30),
+    app.config.get('REVOCATION_OVERLAP', 300), app.config.get('REVOCATION_MAX_AGE', 14 * 24 * 3600))
+  
+  from .auth.registry import role_registry
   
-  app.register_blueprint(role_bp, url_prefix='/api/role')
-  app.register_blueprint(auth_bp, url_prefix='/api/auth')
+  role_registry.ttl = app.config.get('ROLE_CACHE_TTL', 30)
+  
+  from .auth.breaker import configure_breakers
+  
+  configure_breakers(app.config.get('BREAKER_FAILURE_RATE', 0.5), app.config.get('BREAKER_MIN_CALLS', 10),
+    app.config.get('BREAKER_WINDOW', 30), app.config.get('BREAKER_OPEN_SECONDS', 15),
+    app.config.get('BREAKER_HALF_OPEN_PROBES', 2))
+  
+  from .auth.batch import batch_verifier
+  
+  batch_verifier.configure(app.config.get('BATCH_VERIFY_WORKERS'), app.config.get('BATCH_VERIFY_INLINE_BELOW', 4),
+    app.config.get('BATCH_VERIFY_TIMEOUT', 10))
   
   # register error handlers
   from .error_handlers import BaseAuthException, handle_known_error, handle_422, handle_503, handle_400,\
-    handle_404, handle_405
+    handle_404, handle_405, handle_429
   
   app.register_error_handler(BaseAuthException, handle_known_error)
   app.register_error_handler(422, handle_422)
@@ -142,15 +173,29 @@ def create_app(config_name: str|None = None) -> Flask:
   app.register_error_handler(400, handle_400)
   app.register_error_handler(404, handle_404)
   app.register_error_handler(405, handle_405)
+  app.register_error_handler(429, handle_429)
+  
+  # expose /metrics, time every request
+  from . import metrics, instrumentation
+  
+  metrics.init_app(app)
+  instrumentation.init_app(app)
+  instrumentation.preallocate(app)
+  
+  # load shedding, runs before every other request hook
+  from . import admission
+  
+  admission.init_app(app)
   
   # register cli functons
-  # from .utils import app_cli
+  from .utils import app_cli
   
-  # app.cli.add_command(app_cli)
+  app.cli.add_command(app_cli)
   
   # testing
   # db.create_all(app=app)
   
+  app.logger.info('startup report %s', startup_report.as_dict())
   return app
 
 
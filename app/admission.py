@@ -0,0 +1,121 @@
+'''
+  Admission control, sheds load with a fast 503 instead of letting requests queue until they time out
+  each route gets a priority, lower priorities are refused first as a worker fills up or as
+  requests arrive having already waited in front of it
+'''
+import time, threading
+from typing import Dict, Iterable
+from flask import Flask, g, request
+from werkzeug.exceptions import ServiceUnavailable
+from .metrics import registry
+
+CRITICAL, NORMAL, LOW = 'critical', 'normal', 'low'
+
+# share of the limits each priority may use, critical traffic may use all of it
+SHARES = {CRITICAL: 1.0, NORMAL: 0.75, LOW: 0.5}
+
+# logins and session checks are shed last, admin traffic first
+DEFAULT_CRITICAL_PATHS = ('/api/auth/sessionLogin', '/api/auth/sessionLogout', '/api/auth/verify_session',
+  '/_ah/warmup', '/metrics')
+DEFAULT_LOW_PATHS = ('/api/role/', '/api/user/')
+
+rejected = registry.counter('admission_rejected_total', 'Requests shed by admission control')
+
+
+class Overloaded(ServiceUnavailable):
+  '''handled by handle_503'''
+  def __init__(self, retry_after: int = 1):
+    super().__init__(description='Server busy, try again later')
+    self.retry_after = retry_after
+
+
+def parse_request_start(value: str|None) -> float|None:
+  '''unix time from an X-Request-Start header, t=<seconds|ms|us> as set by nginx and most routers'''
+  if not value:
+    return None
+  try:
+    started = float(value.strip().removeprefix('t='))
+  except ValueError:
+    return None
+  # scale by magnitude, ms and us timestamps are far past any unix time in seconds
+  if started > 1e14:
+    return started / 1e6
+  if started > 1e11:
+    return started / 1e3
+  return started
+
+
+class AdmissionController:
+  def __init__(self, max_in_flight: int = 0, max_queue_wait: float = 0, queue_header: str|None = 'X-Request-Start'):
+    # 0 turns either limit off
+    self.max_in_flight = max_in_flight
+    self.max_queue_wait = max_queue_wait
+    self.queue_header = queue_header
+    self.in_flight = 0
+    self.priorities: Dict[str|None, str] = {}
+    self._lock = threading.Lock()
+
+  def configure(self, app: Flask, critical_paths: Iterable[str], low_paths: Iterable[str]):
+    '''resolve every endpoint's priority once, from the longest matching path prefix'''
+    prefixes = sorted([(path, CRITICAL) for path in critical_paths] + [(path, LOW) for path in low_paths],
+      key=lambda item: len(item[0]), reverse=True)
+    for rule in app.url_map.iter_rules():
+      priority = next((level for path, level in prefixes if rule.rule.startswith(path)), NORMAL)
+      # an endpoint on several rules keeps its most important priority
+      current = self.priorities.get(rule.endpoint)
+      if current is None or SHARES[priority] > SHARES[current]:
+        self.priorities[rule.endpoint] = priority
+
+  def admit(self, priority: str, queue_wait: float|None) -> str|None:
+    '''take a slot, or return why the request is shed'''
+    share = SHARES[priority]
+    if self.max_queue_wait and queue_wait is not None and queue_wait > self.max_queue_wait * share:
+      return 'queue_wait'
+    with self._lock:
+      if self.max_in_flight and self.in_flight >= max(1, int(self.max_in_flight * share)):
+        return 'in_flight'
+      self.in_flight += 1
+    return None
+
+  def release(self):
+    with self._lock:
+      self.in_flight -= 1
+
+  def before_request(self):
+    if not self.max_in_flight and not self.max_queue_wait:
+      return
+    priority = self.priorities.get(request.endpoint, NORMAL)
+    queue_wait = None
+    if self.queue_header:
+      started = parse_request_start(request.headers.get(self.queue_header))
+      if started is not None:
+        queue_wait = time.time() - started
+    reason = self.admit(priority, queue_wait)
+    if reason is not None:
+      rejected.inc(priority=priority, reason=reason)
+      raise Overloaded()
+    g._admitted = True
+
+  def teardown_request(self, exc):
+    if g.pop('_admitted', False):
+      self.release()
+
+
+# per worker process
+admission = AdmissionController()
+registry.gauge('admission_in_flight', 'Requests admitted and in progress', lambda: admission.in_flight)
+
+
+def init_app(app: Flask):
+  """Install admission control, call after every blueprint is registered
+  config: ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE_WAIT, ADMISSION_QUEUE_HEADER,
+  ADMISSION_CRITICAL_PATHS, ADMISSION_LOW_PATHS
+  """
+  admission.max_in_flight = app.config.get('ADMISSION_MAX_IN_FLIGHT', 0)
+  admission.max_queue_wait = app.config.get('ADMISSION_MAX_QUEUE_WAIT', 0)
+  admission.queue_header = app.config.get('ADMISSION_QUEUE_HEADER', 'X-Request-Start')
+  admission.configure(app, app.config.get('ADMISSION_CRITICAL_PATHS') or DEFAULT_CRITICAL_PATHS,
+    app.config.get('ADMISSION_LOW_PATHS') or DEFAULT_LOW_PATHS)
+  # first, a shed request should cost as little as possible
+  app.before_request_funcs.setdefault(None, []).insert(0, admission.before_request)
+  app.teardown_request(admission.teardown_request)
@@ -0,0 +1,120 @@
+'''
+  Batch id token verification across cpu cores
+  RSA signature checks run in a process pool, each worker initializes firebase from the same
+  env as the web process and verifies against a snapshot of the signing keys
+'''
+import os, math, logging, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+from firebase_admin import auth as fb_auth
+from .keystore import key_store, ID_TOKEN_CERT_URI
+
+logger = logging.getLogger(__name__)
+
+# rejection reasons, endpoints map them to their own messages
+INVALID = 'invalid'
+EXPIRED = 'expired'
+REVOKED = 'revoked'
+# may verify on a retry, iat a little ahead of our clock or signed with a key we haven't loaded yet
+TRANSIENT = 'transient'
+
+# reasons that can never turn valid again, only these go into the negative cache
+CACHED_REJECTIONS = frozenset((INVALID, EXPIRED, REVOKED))
+
+# google.auth messages for failures that depend on the clock or the loaded keys
+TRANSIENT_ERRORS = ('Token used too early', 'Certificate for key id')
+
+Result = Tuple[bool, Dict[str, Any]|str]
+
+
+def verify_one(token: str) -> Result:
+  """Verify a single id token, only certificate fetch errors propagate
+  Returns:
+    Tuple[bool, Dict[str, Any]|str]: (True, claims) or (False, rejection reason)
+  """
+  try:
+    return True, key_store.verify(ID_TOKEN_CERT_URI, fb_auth.verify_id_token, token)
+  except fb_auth.ExpiredIdTokenError:
+    return False, EXPIRED
+  except fb_auth.RevokedIdTokenError:
+    return False, REVOKED
+  except fb_auth.InvalidIdTokenError as e:
+    return False, TRANSIENT if any(message in str(e) for message in TRANSIENT_ERRORS) else INVALID
+  except ValueError:
+    return False, INVALID
+
+
+def _verify_chunk(tokens: List[str]) -> List[Result]:
+  return [verify_one(token) for token in tokens]
+
+
+def _init_worker(key_sets: Dict[str, Dict[str, str]]):
+  # runs once in each pool process
+  from .. import setup_firebase
+
+  fb_app = setup_firebase()
+  for url, keys in key_sets.items():
+    key_store.set_keys(url, keys)
+  key_store.install(fb_app)
+
+
+class BatchVerifier:
+  def __init__(self, workers: int|None = None, inline_below: int = 4, timeout: float = 10):
+    self.workers = workers or os.cpu_count() or 1
+    self.inline_below = inline_below
+    self.timeout = timeout
+    self._pool: ProcessPoolExecutor|None = None
+    self._pool_keys: frozenset|None = None
+    self._lock = threading.Lock()
+
+  def configure(self, workers: int|None, inline_below: int, timeout: float):
+    self.shutdown()
+    self.workers = workers or os.cpu_count() or 1
+    self.inline_below = inline_below
+    self.timeout = timeout
+
+  def _get_pool(self) -> ProcessPoolExecutor:
+    # kids identify the signing keys, a refresh that returns the same certs keeps the pool
+    keys = frozenset(key_store.get_keys(ID_TOKEN_CERT_URI) or ())
+    with self._lock:
+      # signing keys rotated since the workers started, start fresh ones
+      if self._pool is not None and keys != self._pool_keys:
+        self._pool.shutdown(wait=False)
+        self._pool = None
+      if self._pool is None:
+        key_sets = {url: key_store.get_keys(url) for url in key_store.urls.values() if key_store.get_keys(url)}
+        # spawn, forking a threaded web worker can copy held locks into the child
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker, initargs=(key_sets,))
+        self._pool_keys = keys
+      return self._pool
+
+  def verify(self, tokens: List[str]) -> List[Result]:
+    """Verify tokens, results are in the same order as tokens
+    Raises:
+      concurrent.futures.TimeoutError: the pool did not answer within timeout
+    """
+    if len(tokens) < self.inline_below or self.workers <= 1:
+      return _verify_chunk(tokens)
+    pool = self._get_pool()
+    # one chunk per worker keeps pickling overhead to a handful of round trips
+    size = math.ceil(len(tokens) / self.workers)
+    chunks = [tokens[start:start + size] for start in range(0, len(tokens), size)]
+    try:
+      results: List[Result] = []
+      for chunk in pool.map(_verify_chunk, chunks, timeout=self.timeout):
+        results.extend(chunk)
+      return results
+    except Exception:
+      # broken or stuck pool, start a new one on the next batch
+      self.shutdown()
+      raise
+
+  def shutdown(self):
+    with self._lock:
+      if self._pool is not None:
+        self._pool.shutdown(wait=False)
+        self._pool = None
+
+
+batch_verifier = BatchVerifier()
@@ -0,0 +1,172 @@
+'''
+  Circuit breakers around firebase calls
+  a breaker opens once the failure rate over a rolling window crosses a threshold, requests
+  needing that dependency then fail fast with a 503 instead of tying up worker threads, and
+  after a cool down a few probe calls decide whether it closes again
+'''
+import time, logging, threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Tuple
+from firebase_admin import exceptions
+from google.auth.exceptions import TransportError
+from werkzeug.exceptions import ServiceUnavailable
+from .throttle import retry_after_seconds
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# upstream failures, token and user errors mean firebase answered and don't count.
+# UnknownError covers CertificateFetchError from token verification
+FAILURE_ERRORS = (
+  exceptions.UnavailableError,
+  exceptions.ResourceExhaustedError,
+  exceptions.DeadlineExceededError,
+  exceptions.InternalError,
+  exceptions.UnknownError,
+  TransportError,
+  ConnectionError,
+  TimeoutError,
+)
+
+breaker_transitions = registry.counter('circuit_breaker_transitions_total', 'Circuit breaker state changes')
+breaker_rejections = registry.counter('circuit_breaker_rejected_total', 'Calls refused while a circuit breaker was open')
+
+
+class CircuitOpenError(ServiceUnavailable):
+  '''handled by handle_503'''
+  def __init__(self, description: str, retry_after: int):
+    super().__init__(description=description)
+    self.retry_after = retry_after
+
+
+class CircuitBreaker:
+  def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10, window: float = 30,
+               open_seconds: float = 15, half_open_probes: int = 2):
+    self.name = name
+    self.failure_rate = failure_rate
+    # don't open on a couple of unlucky calls
+    self.min_calls = min_calls
+    self.window = window
+    self.open_seconds = open_seconds
+    self.half_open_probes = half_open_probes
+    self.state = CLOSED
+    self._opened_at = 0.0
+    self._probes = 0
+    self._probe_successes = 0
+    # (second, calls, failures), one bucket per second of the window
+    self._buckets: Deque[Tuple[int, int, int]] = deque()
+    self._calls = 0
+    self._failures = 0
+    self._lock = threading.Lock()
+
+  def configure(self, failure_rate: float, min_calls: int, window: float, open_seconds: float, half_open_probes: int):
+    with self._lock:
+      self.failure_rate = failure_rate
+      self.min_calls = min_calls
+      self.window = window
+      self.open_seconds = open_seconds
+      self.half_open_probes = half_open_probes
+
+  def _transition(self, state: str):
+    # caller holds the lock
+    if state == self.state:
+      return
+    logger.warning('circuit breaker %s %s -> %s', self.name, self.state, state)
+    self.state = state
+    breaker_transitions.inc(breaker=self.name, state=state)
+    if state == OPEN:
+      self._opened_at = time.monotonic()
+    if state != CLOSED:
+      self._probes = 0
+      self._probe_successes = 0
+    if state == CLOSED:
+      self._buckets.clear()
+      self._calls = self._failures = 0
+
+  def _expire(self, now: int):
+    while self._buckets and self._buckets[0][0] <= now - self.window:
+      _, calls, failures = self._buckets.popleft()
+      self._calls -= calls
+      self._failures -= failures
+
+  def before_call(self) -> bool:
+    """Admit a call or raise CircuitOpenError
+    Returns:
+      bool: True if the call is a half open probe
+    """
+    with self._lock:
+      if self.state == OPEN:
+        remaining = self._opened_at + self.open_seconds - time.monotonic()
+        if remaining > 0:
+          breaker_rejections.inc(breaker=self.name)
+          raise CircuitOpenError('Authentication service unavailable, try again later', retry_after_seconds(remaining))
+        self._transition(HALF_OPEN)
+      if self.state == HALF_OPEN:
+        if self._probes >= self.half_open_probes:
+          breaker_rejections.inc(breaker=self.name)
+          raise CircuitOpenError('Authentication service unavailable, try again later', retry_after_seconds(1))
+        self._probes += 1
+        return True
+      return False
+
+  def record(self, ok: bool, probe: bool = False):
+    with self._lock:
+      if probe:
+        if self.state != HALF_OPEN:
+          return
+        if not ok:
+          self._transition(OPEN)
+          return
+        self._probe_successes += 1
+        if self._probe_successes >= self.half_open_probes:
+          self._transition(CLOSED)
+        return
+      now = int(time.monotonic())
+      self._expire(now)
+      if self._buckets and self._buckets[-1][0] == now:
+        _, calls, failures = self._buckets[-1]
+        self._buckets[-1] = (now, calls + 1, failures + (not ok))
+      else:
+        self._buckets.append((now, 1, int(not ok)))
+      self._calls += 1
+      self._failures += not ok
+      if self.state == CLOSED and self._calls >= self.min_calls and self._failures >= self.failure_rate * self._calls:
+        self._transition(OPEN)
+
+  @contextmanager
+  def guard(self):
+    '''run the block as one call, upstream failures are counted and surface as a 503'''
+    probe = self.before_call()
+    try:
+      yield
+    except FAILURE_ERRORS as e:
+      self.record(False, probe)
+      logger.warning('%s call failed: %s', self.name, e)
+      raise ServiceUnavailable(description='Authentication service unavailable, try again later') from e
+    except BaseException:
+      self.record(True, probe)
+      raise
+    else:
+      self.record(True, probe)
+
+  def stats(self) -> Dict[str, int|str]:
+    return {'state': self.state, 'calls': self._calls, 'failures': self._failures}
+
+
+# token and cookie verification, only reaches google when certificates are missing
+firebase_verify = CircuitBreaker('firebase_verify')
+# user management and session cookie minting through the firebase admin api
+firebase_admin_api = CircuitBreaker('firebase_admin')
+breakers = (firebase_verify, firebase_admin_api)
+
+registry.gauge('circuit_breaker_state', 'Circuit breaker state, 0 closed, 1 half open, 2 open',
+  lambda: {(('breaker', breaker.name),): STATE_VALUES[breaker.state] for breaker in breakers})
+
+
+def configure_breakers(failure_rate: float, min_calls: int, window: float, open_seconds: float, half_open_probes: int):
+  for breaker in breakers:
+    breaker.configure(failure_rate, min_calls, window, open_seconds, half_open_probes)
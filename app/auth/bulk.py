@@ -0,0 +1,220 @@
+'''
+  Streaming bulk import and export of users and their roles
+  records flow through in fixed size chunks, one multi row insert and one commit per chunk,
+  so memory stays constant whatever the size of the tenant
+'''
+import csv, json, time, logging
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, TextIO
+
+logger = logging.getLogger(__name__)
+
+# firebase list_users returns at most 1000 users per page
+FIREBASE_PAGE_SIZE = 1000
+
+# separator for roles in a csv column
+CSV_ROLE_SEPARATOR = ';'
+CSV_FIELDS = ('user_id', 'email', 'email_verified', 'username', 'roles')
+
+
+@dataclass
+class BulkReport:
+  read: int = 0
+  inserted: int = 0
+  skipped: int = 0
+  role_links: int = 0
+  unknown_roles: int = 0
+  elapsed: float = 0.0
+
+  @property
+  def throughput(self) -> float:
+    return self.read / self.elapsed if self.elapsed else 0.0
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      'read': self.read,
+      'inserted': self.inserted,
+      'skipped': self.skipped,
+      'role_links': self.role_links,
+      'unknown_roles': self.unknown_roles,
+      'elapsed': round(self.elapsed, 3),
+      'rows_per_second': round(self.throughput, 2),
+    }
+
+
+def _as_bool(value) -> bool:
+  if isinstance(value, str):
+    return value.strip().lower() in ('1', 'true', 'yes', 'y')
+  return bool(value)
+
+
+def normalize_record(record: Dict[str, Any]) -> Dict[str, Any]:
+  '''user row plus role names from an ndjson/csv/firebase record'''
+  roles = record.get('roles') or []
+  if isinstance(roles, str):
+    roles = [name for name in roles.split(CSV_ROLE_SEPARATOR) if name]
+  return {
+    'user_id': record.get('user_id') or record.get('uid'),
+    'email': record.get('email'),
+    'email_verified': _as_bool(record.get('email_verified', False)),
+    'username': record.get('username') or 'Anonymous',
+    'roles': [name.strip() for name in roles],
+  }
+
+
+def iter_file_records(stream: TextIO, fmt: str = 'ndjson') -> Iterator[Dict[str, Any]]:
+  """Read records lazily from an ndjson or csv stream
+  Args:
+    stream (TextIO): open file or stdin
+    fmt (str): ndjson or csv, csv roles are separated by ;
+  """
+  if fmt == 'csv':
+    for row in csv.DictReader(stream):
+      yield normalize_record(row)
+    return
+  for line in stream:
+    line = line.strip()
+    if line:
+      yield normalize_record(json.loads(line))
+
+
+def iter_firebase_records(client=None) -> Iterator[Dict[str, Any]]:
+  '''page through every firebase user, roles come from the Roles custom claim'''
+  if client is None:
+    from firebase_admin import auth as client
+
+  for user in client.list_users(max_results=FIREBASE_PAGE_SIZE).iterate_all():
+    yield normalize_record({
+      'uid': user.uid,
+      'email': user.email,
+      'email_verified': user.email_verified,
+      'username': user.display_name,
+      'roles': (user.custom_claims or {}).get('Roles'),
+    })
+
+
+def chunked(records: Iterable, size: int) -> Iterator[List]:
+  iterator = iter(records)
+  while True:
+    chunk = list(islice(iterator, size))
+    if not chunk:
+      return
+    yield chunk
+
+
+def _insert_ignore(table, rows: List[Dict[str, Any]]) -> int:
+  '''multi row insert skipping rows that hit any unique constraint, returns rows inserted'''
+  from .. import db
+
+  dialect = db.engine.dialect.name
+  if dialect == 'postgresql':
+    from sqlalchemy.dialects.postgresql import insert
+  elif dialect == 'sqlite':
+    from sqlalchemy.dialects.sqlite import insert
+  else:
+    # no portable on conflict, drop rows whose primary key already exists
+    keys = [column for column in table.primary_key.columns]
+    existing = set(db.session.execute(
+      db.select(*keys).where(db.tuple_(*keys).in_([tuple(row[key.name] for key in keys) for row in rows]))
+    ))
+    rows = [row for row in rows if tuple(row[key.name] for key in keys) not in existing]
+    if not rows:
+      return 0
+    return db.session.execute(table.insert().values(rows)).rowcount
+  return db.session.execute(insert(table).values(rows).on_conflict_do_nothing()).rowcount
+
+
+class UserImporter:
+  '''
+    Loads users and user_role links chunk by chunk, existing users and links are left untouched
+  '''
+  def __init__(self, chunk_size: int = 1000, progress=None):
+    self.chunk_size = chunk_size
+    # called with the report after every chunk
+    self.progress = progress
+
+  def import_chunk(self, records: List[Dict[str, Any]], report: BulkReport):
+    from .models import User, user_role
+    from .. import db
+
+    report.read += len(records)
+    rows = {}
+    for record in records:
+      # the users table requires both
+      if not record['user_id'] or not record['email']:
+        report.skipped += 1
+        continue
+      rows[record['user_id']] = record
+    if not rows:
+      return
+    users = [{key: record[key] for key in ('user_id', 'email', 'email_verified', 'username')} for record in rows.values()]
+    inserted = _insert_ignore(User.__table__, users)
+    report.inserted += inserted
+    report.skipped += len(rows) - inserted
+
+    # link roles only for users that exist, a row skipped on a duplicate email does not
+    from .registry import role_registry
+
+    wanted = [user_id for user_id, record in rows.items() if record['roles']]
+    present = {user_id for user_id, in db.session.query(User.user_id).filter(User.user_id.in_(wanted))} if wanted else set()
+    links = []
+    for user_id in present:
+      for name in rows[user_id]['roles']:
+        role = role_registry.lookup(name)
+        if role is None:
+          report.unknown_roles += 1
+        else:
+          links.append({'user_id': user_id, 'role_id': role.role_id})
+    if links:
+      report.role_links += _insert_ignore(user_role, links)
+    db.session.commit()
+
+  def run(self, records: Iterable[Dict[str, Any]]) -> BulkReport:
+    from .. import db
+
+    report = BulkReport()
+    started = time.perf_counter()
+    for chunk in chunked(records, self.chunk_size):
+      try:
+        self.import_chunk(chunk, report)
+      except Exception:
+        db.session.rollback()
+        raise
+      report.elapsed = time.perf_counter() - started
+      if self.progress is not None:
+        self.progress(report)
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def iter_export_records(chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+  '''every user with sorted role names, one keyset page in memory at a time'''
+  from .models import User
+
+  after = None
+  while True:
+    users = User.page(after, chunk_size)
+    if not users:
+      return
+    roles = User.role_names([user['user_id'] for user in users])
+    for user in users:
+      yield {**user, 'roles': roles[user['user_id']]}
+    after = users[-1]['user_id']
+
+
+def write_records(records: Iterable[Dict[str, Any]], stream: TextIO, fmt: str = 'ndjson') -> int:
+  '''stream records out as ndjson or csv, returns how many were written'''
+  written = 0
+  if fmt == 'csv':
+    writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for record in records:
+      writer.writerow({**record, 'roles': CSV_ROLE_SEPARATOR.join(record['roles'])})
+      written += 1
+    return written
+  for record in records:
+    stream.write(json.dumps(record, separators=(',', ':')))
+    stream.write('\n')
+    written += 1
+  return written
@@ -0,0 +1,164 @@
+'''
+  Sync the Roles custom claim in firebase with the user_role table
+  roles are diffed against the current claims and only changed users are pushed,
+  through a bounded worker pool with retry and backoff
+'''
+import time, random, logging
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Tuple
+from firebase_admin import auth as fb_auth, exceptions
+from google.auth.exceptions import TransportError
+
+logger = logging.getLogger(__name__)
+
+# firebase get_users accepts at most 100 identifiers
+GET_USERS_BATCH = 100
+
+# errors worth retrying, everything else is reported as failed
+RETRYABLE_ERRORS = (
+  exceptions.UnavailableError,
+  exceptions.ResourceExhaustedError,
+  exceptions.DeadlineExceededError,
+  exceptions.InternalError,
+  exceptions.UnknownError,
+  TransportError,
+  ConnectionError,
+)
+
+
+@dataclass
+class SyncReport:
+  scanned: int = 0
+  changed: int = 0
+  updated: int = 0
+  failed: int = 0
+  missing: int = 0
+  retries: int = 0
+  elapsed: float = 0.0
+  failures: List[Tuple[str, str]] = field(default_factory=list)
+
+  @property
+  def throughput(self) -> float:
+    return self.updated / self.elapsed if self.elapsed else 0.0
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      'scanned': self.scanned,
+      'changed': self.changed,
+      'updated': self.updated,
+      'failed': self.failed,
+      'missing': self.missing,
+      'retries': self.retries,
+      'elapsed': round(self.elapsed, 3),
+      'updates_per_second': round(self.throughput, 2),
+    }
+
+
+def iter_db_roles(chunk_size: int = 500) -> Iterator[Dict[str, List[str]]]:
+  """Page through users by user_id, yielding {user_id: sorted role names} per page
+  users without roles are included so stale claims get cleared
+  Args:
+    chunk_size (int): users per page
+  """
+  from .models import User
+
+  after = None
+  while True:
+    user_ids = [user['user_id'] for user in User.page(after, chunk_size)]
+    if not user_ids:
+      return
+    yield User.role_names(user_ids)
+    after = user_ids[-1]
+
+
+class ClaimsSync:
+  '''
+    Pushes Roles claims for users whose firebase claims differ from the db
+    client defaults to firebase_admin.auth, anything with get_users and
+    set_custom_user_claims works, e.g a local fake in tests
+  '''
+  def __init__(self, client=fb_auth, workers: int = 8, max_retries: int = 5,
+               backoff: float = 0.5, max_backoff: float = 30, dry_run: bool = False):
+    self.client = client
+    self.workers = workers
+    self.max_retries = max_retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.dry_run = dry_run
+
+  def current_claims(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    '''custom claims per uid, uids missing in firebase are left out'''
+    claims: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(user_ids), GET_USERS_BATCH):
+      batch = [fb_auth.UidIdentifier(uid) for uid in user_ids[start:start + GET_USERS_BATCH]]
+      result = self._with_retry(self.client.get_users, batch)
+      for user in result.users:
+        claims[user.uid] = user.custom_claims or {}
+    return claims
+
+  def diff(self, db_roles: Dict[str, List[str]], claims: Dict[str, Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+    '''(uid, new claims) for every user whose Roles claim does not match the db'''
+    changes = []
+    for user_id, roles in db_roles.items():
+      current = claims.get(user_id)
+      if current is None:
+        continue
+      if sorted(current.get('Roles') or []) != roles:
+        # keep any other custom claims untouched
+        changes.append((user_id, {**current, 'Roles': roles}))
+    return changes
+
+  def _with_retry(self, func, *args, report: SyncReport|None = None):
+    attempt = 0
+    while True:
+      try:
+        return func(*args)
+      except RETRYABLE_ERRORS:
+        if attempt >= self.max_retries:
+          raise
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        # full jitter so workers don't retry in lockstep
+        time.sleep(random.uniform(0, delay))
+        attempt += 1
+        if report is not None:
+          report.retries += 1
+
+  def _push(self, change: Tuple[str, Dict[str, Any]], report: SyncReport) -> Tuple[str, str|None]:
+    user_id, claims = change
+    try:
+      self._with_retry(self.client.set_custom_user_claims, user_id, claims, report=report)
+    except Exception as e:
+      return user_id, str(e) or e.__class__.__name__
+    return user_id, None
+
+  def run(self, pages: Iterator[Dict[str, List[str]]]) -> SyncReport:
+    """Sync every page of db roles
+    Args:
+      pages (Iterator[Dict[str, List[str]]]): {user_id: sorted roles} per page, see iter_db_roles
+    Returns:
+      SyncReport: counts and throughput
+    """
+    report = SyncReport()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='claims-sync') as pool:
+      for db_roles in pages:
+        report.scanned += len(db_roles)
+        claims = self.current_claims(list(db_roles))
+        report.missing += len(db_roles) - len(claims)
+        changes = self.diff(db_roles, claims)
+        report.changed += len(changes)
+        if self.dry_run or not changes:
+          continue
+        # one page in flight at a time keeps memory bounded
+        for user_id, error in pool.map(lambda change: self._push(change, report), changes):
+          if error is None:
+            report.updated += 1
+          else:
+            report.failed += 1
+            report.failures.append((user_id, error))
+            logger.warning('Failed to sync claims for %s: %s', user_id, error)
+        report.elapsed = time.perf_counter() - started
+        logger.info('claims sync progress %s', report.to_dict())
+    report.elapsed = time.perf_counter() - started
+    return report
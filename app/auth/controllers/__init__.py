@@ -1,20 +1,234 @@
 '''
   Contains user authentication/authorization code for app
 '''
-import time, datetime
-from typing import Any, Dict, List
+import time, datetime, hashlib, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
 from functools import wraps
 from flask import request, jsonify, make_response, Response, current_app as app
 from firebase_admin import auth as fb_auth, exceptions
-from google.auth.exceptions import TransportError
 from dotenv import load_dotenv
-from ..models import User, Role
+from ..models import User, Role, TokenRevocation
+from ..permissions import Permission, permission_engine, reload_permissions
+from ..throttle import token_limiter, retry_after_seconds
+from ..revocation import revocation_index
+from ..keystore import key_store, COOKIE_CERT_URI
+from ..cookie_signer import cookie_signer, observe_mint
+from ...metrics import registry
+from ..breaker import firebase_verify, firebase_admin_api
+from ..batch import verify_one, INVALID, EXPIRED, REVOKED, TRANSIENT, CACHED_REJECTIONS
+from werkzeug.exceptions import TooManyRequests
+from ... import db
 from ...error_handlers import RequestException, UnauthorizedException
+from ...instrumentation import phase
 
 # load env
 load_dotenv()
 
 
+class TTLCache:
+  '''
+    Bounded, thread safe LRU cache where every entry carries its own expiry.
+    Keys are expected to be hashes, never raw secrets.
+  '''
+  def __init__(self, max_size: int = 1024, ttl: int = 300):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._data: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def configure(self, max_size: int, ttl: int):
+    with self._lock:
+      self.max_size = max_size
+      self.ttl = ttl
+      self._data.clear()
+
+  def get(self, key: str) -> Any|None:
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      expires_at, value = entry
+      if expires_at <= time.time():
+        del self._data[key]
+        self.misses += 1
+        return None
+      self._data.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def set(self, key: str, value: Any, expires_at: float|None = None):
+    """Store value, the entry lives for ttl seconds but never past expires_at
+    Args:
+      key (str): cache key
+      value (Any): value to store
+      expires_at (float|None): absolute unix time the value stops being valid
+    """
+    if self.max_size <= 0:
+      return
+    deadline = time.time() + self.ttl
+    if expires_at is not None:
+      deadline = min(deadline, expires_at)
+    with self._lock:
+      self._data[key] = (deadline, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.max_size:
+        self._data.popitem(last=False)
+        self.evictions += 1
+
+  def invalidate(self, key: str) -> bool:
+    with self._lock:
+      return self._data.pop(key, None) is not None
+
+  def invalidate_where(self, predicate) -> int:
+    '''drop every entry whose value matches predicate, linear but only used on revocation'''
+    with self._lock:
+      keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+      for key in keys:
+        del self._data[key]
+      return len(keys)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  def stats(self) -> Dict[str, int]:
+    return {
+      'size': len(self._data),
+      'max_size': self.max_size,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+    }
+
+
+# verified session cookies, keyed by sha256 of the cookie
+session_cache = TTLCache()
+
+
+# recently rejected id tokens, keyed by sha256 of the token, value is the rejection reason
+rejected_tokens = TTLCache()
+
+# messages for validate_token_or_raise, by rejection reason
+caches = {'session': session_cache, 'rejected_tokens': rejected_tokens}
+
+
+def _cache_stats(stat: str):
+  def collect():
+    return {(('cache', name),): cache.stats()[stat] for name, cache in caches.items()}
+  return collect
+
+
+registry.gauge('auth_cache_size', 'Entries in the cache', _cache_stats('size'))
+registry.gauge('auth_cache_max_size', 'Configured cache size', _cache_stats('max_size'))
+registry.gauge('auth_cache_hits', 'Lookups answered from the cache', _cache_stats('hits'))
+registry.gauge('auth_cache_misses', 'Lookups not in the cache or expired', _cache_stats('misses'))
+registry.gauge('auth_cache_evictions', 'Entries dropped to stay under max_size', _cache_stats('evictions'))
+
+TOKEN_REJECTIONS = {
+  INVALID: 'Invalid Token. Please login again.',
+  EXPIRED: 'Token expired. Please login again.',
+  REVOKED: 'Token revoked. Please login again.',
+  TRANSIENT: 'Invalid Token. Please login again.',
+}
+
+
+def init_session_cache(max_size: int, ttl: int):
+  session_cache.configure(max_size, ttl)
+
+
+def remember_rejection(token_key: str, reason: str):
+  '''negative cache the token, unless a retry of the same token may still verify'''
+  if reason in CACHED_REJECTIONS:
+    rejected_tokens.set(token_key, reason)
+
+
+def init_token_guards(negative_cache_size: int, negative_cache_ttl: int, rate: float, burst: int, max_clients: int):
+  rejected_tokens.configure(negative_cache_size, negative_cache_ttl)
+  token_limiter.configure(rate, burst, max_clients)
+
+
+def throttle_or_raise(cost: int = 1):
+  '''charge the client ip cost tokens, 429 once it runs out'''
+  # remote_addr is the real client, ProxyFix rewrites it in production
+  wait = token_limiter.allow(request.remote_addr or '', cost)
+  if wait:
+    raise TooManyRequests('Too many requests, slow down.', retry_after=retry_after_seconds(wait))
+
+
+def rate_limited(func):
+  '''reject with 429 once the client ip runs out of tokens, before any verification'''
+  @wraps(func)
+  def wrapper(*args, **kwargs):
+    throttle_or_raise()
+    return func(*args, **kwargs)
+  return wrapper
+
+
+def hash_secret(secret: str) -> str:
+  return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+
+def invalidate_session(session_cookie: str|None) -> bool:
+  """Drop a session cookie from the verified session cache, used on logout
+  Args:
+    session_cookie (str|None): firebase auth session cookie
+  Returns:
+    bool: True if the cookie was cached
+  """
+  if not session_cookie:
+    return False
+  return session_cache.invalidate(hash_secret(session_cookie))
+
+
+def init_revocation_index(refresh_interval: int, overlap: int, max_age: int):
+  revocation_index.configure(refresh_interval, overlap, max_age)
+
+
+def revoke_user_sessions_or_raise(user_id: str) -> int:
+  """Revoke every refresh token, id token and session cookie of a user
+  firebase is updated first, then the shared index so every instance enforces it
+  Args:
+    user_id (str): firebase user id
+  Raises:
+    RequestException: Unknown user or firebase/db failure
+  Returns:
+    int: unix time tokens must be issued after to stay valid
+  """
+  try:
+    with firebase_admin_api.guard():
+      fb_auth.revoke_refresh_tokens(user_id)
+      valid_after = fb_auth.get_user(user_id).tokens_valid_after_timestamp // 1000
+  except (ValueError, fb_auth.UserNotFoundError):
+    raise RequestException(404, 'not found', 'User not found')
+  except exceptions.FirebaseError:
+    app.logger.error('Failed to revoke tokens', exc_info=True)
+    raise RequestException(description='Failed to revoke tokens')
+  try:
+    TokenRevocation.record(user_id, valid_after)
+  except Exception:
+    db.session.rollback()
+    app.logger.error('Failed to record revocation', exc_info=True)
+    raise RequestException(description='Failed to revoke tokens')
+  revocation_index.record(user_id, valid_after)
+  invalidate_user_sessions(user_id)
+  return valid_after
+
+
+def invalidate_user_sessions(user_id: str) -> int:
+  """Drop every cached session belonging to a user, used on revocation
+  Args:
+    user_id (str): firebase user id
+  Returns:
+    int: number of cached sessions dropped
+  """
+  return session_cache.invalidate_where(lambda claims: claims.get('uid') == user_id)
+
+
 def is_payload_authtime_less(payload: Dict[str, Any], minutes: int) -> bool:
   """Check if the payload auth_time is less than supllied minutes
   Args:
@@ -45,8 +259,19 @@ def verify_session_or_raise(session_cookie: str) -> Dict[str, Any]:
   Returns:
     Dict[str, Any]: The user client claims
   """
+  if not session_cookie:
+    raise UnauthorizedException(description='Invalid token')
+  # hot path, cookie was verified recently and has not expired
+  cache_key = hash_secret(session_cookie)
+  decoded_token = session_cache.get(cache_key)
+  if decoded_token is not None:
+    if revocation_index.is_revoked(decoded_token):
+      session_cache.invalidate(cache_key)
+      raise UnauthorizedException(description='Session cookie revoked. Please login again.')
+    return decoded_token
   try:
-    decoded_token = fb_auth.verify_session_cookie(session_cookie)
+    with phase('firebase'), firebase_verify.guard():
+      decoded_token = key_store.verify(COOKIE_CERT_URI, fb_auth.verify_session_cookie, session_cookie)
   except ValueError:
     raise UnauthorizedException(description='Invalid token')
   except fb_auth.ExpiredSessionCookieError:
@@ -56,33 +281,44 @@ def verify_session_or_raise(session_cookie: str) -> Dict[str, Any]:
     raise UnauthorizedException(description='Session cookie revoked. Please login again.')
   except fb_auth.InvalidSessionCookieError:
     raise UnauthorizedException(description='Invalid session cookie. Please login again.')
-  except TransportError:
-    # most likely a network error, log this?
-    app.logger.error('Failed to fetch certificate', exc_info=True)
-    raise UnauthorizedException(description='Failed to fetch certificate, try again later')
+  # revocation is checked locally, see revocation.py
+  if revocation_index.is_revoked(decoded_token):
+    raise UnauthorizedException(description='Session cookie revoked. Please login again.')
+  session_cache.set(cache_key, decoded_token, expires_at=decoded_token.get('exp'))
   return decoded_token
 
 
-def check_permission(cookie: str, role: str|List):
-  try:
-    decoded_token: Dict[str, Any] = verify_session_or_raise(cookie)
-    roles = decoded_token['Roles']
-  except ValueError:
-    raise UnauthorizedException(description='Invalid token')
-  except fb_auth.ExpiredSessionCookieError:
-    raise UnauthorizedException(description='Session cookie expired. Please login again.')
-  except fb_auth.RevokedSessionCookieError:
-    raise UnauthorizedException(description='Session cookie revoked. Please login again.')
-  except fb_auth.InvalidSessionCookieError:
-    raise UnauthorizedException(description='Invalid session cookie. Please login again.')
-  if not isinstance(role, list):
-    role = [role]
-  for r in role:
-    if r in roles:
-      return True
+def check_permission(cookie: str, role: str|List|Permission):
+  """Verify the session cookie and check its Roles claim against the role hierarchy
+  Args:
+    cookie (str): firebase auth session cookie
+    role (str|List|Permission): accepted roles, precompiled by require_authorization
+  Raises:
+    UnauthorizedException: Authentication error or missing role
+  Returns:
+    bool: True if authorized
+  """
+  decoded_token: Dict[str, Any] = verify_session_or_raise(cookie)
+  permission = permission_engine.compile(role)
+  if permission_engine.allows(permission, decoded_token.get('Roles', ())):
+    return True
   raise UnauthorizedException(403, 'Forbidden', 'You are not authorized to perform this action.')
 
 
+def create_session_cookie(payload: dict, id_token: str, expires_in: datetime.timedelta) -> str:
+  """Mint a session cookie for a verified id token
+  signed locally with the service account key when possible, see cookie_signer.py,
+  otherwise through firebase
+  """
+  if cookie_signer.can_mint():
+    return cookie_signer.mint(payload, expires_in)
+  started = time.perf_counter()
+  with firebase_admin_api.guard():
+    session_cookie = fb_auth.create_session_cookie(id_token, expires_in=expires_in)
+  observe_mint('firebase', time.perf_counter() - started)
+  return session_cookie
+
+
 def set_session_cookie_response_or_raise(payload: dict, id_token: str) -> Response:
   try:
     # To ensure that cookies are set only on recently signed in users, check auth_time in
@@ -91,7 +327,8 @@ def set_session_cookie_response_or_raise(payload: dict, id_token: str) -> Respon
       #  Set session expiration to 5 days.
       expires_in = datetime.timedelta(days=5)
       expires = datetime.datetime.now() + expires_in
-      session_cookie = fb_auth.create_session_cookie(id_token, expires_in=expires_in)
+      with phase('cookie'):
+        session_cookie = create_session_cookie(payload, id_token, expires_in)
       response = make_response(jsonify({'status': 'success'}), 200)
       # same site="None" is required for the session cookie to work in all browsers and localhost
       # response.set_cookie(
@@ -108,6 +345,7 @@ def set_session_cookie_response_or_raise(payload: dict, id_token: str) -> Respon
   
 def validate_token_or_raise(token: str) -> Dict[str, Any]:
   """Validate firebase auth token or raise UnauthorizedException
+  tokens rejected recently are refused from the negative cache without any crypto
   Args:
     token (str): firebase auth id token
   Raises:
@@ -115,22 +353,23 @@ def validate_token_or_raise(token: str) -> Dict[str, Any]:
   Returns:
     Dict[str, Any]: The user client claims
   """
-  try:
-    decoded_token = fb_auth.verify_id_token(token)
-  except ValueError:
-    raise UnauthorizedException(description='Invalid token')
-  except fb_auth.ExpiredIdTokenError:
-    raise UnauthorizedException(description='Token expired. Please login again.')
-  except fb_auth.RevokedIdTokenError:
-    raise UnauthorizedException(description='Token revoked. Please login again.')
-  except fb_auth.InvalidIdTokenError:
-    raise UnauthorizedException(description='Invalid Token. Please login again.')
-  return decoded_token
+  token_key = hash_secret(token)
+  reason = rejected_tokens.get(token_key)
+  if reason is not None:
+    raise UnauthorizedException(description=TOKEN_REJECTIONS[reason])
+  with phase('firebase'), firebase_verify.guard():
+    valid, outcome = verify_one(token)
+  if valid:
+    if not revocation_index.is_revoked(outcome):
+      return outcome
+    outcome = REVOKED
+  remember_rejection(token_key, outcome)
+  raise UnauthorizedException(description=TOKEN_REJECTIONS[outcome])
 
 
 def require_authentication(func):
   def wrapper(*args, **kwargs):
-    session_cookie = request.cookies.get('session-mb')
+    session_cookie = get_session_cookie()
     if not session_cookie:
       # Session cookie is unavailable. Force user to login. can be a redirect
       raise UnauthorizedException(description='Session cookie unavailable. Please login.')
@@ -143,15 +382,16 @@ def require_authentication(func):
 
 
 def require_authorization(role: str|List):
+  # compiled once at import, the check itself is a set intersection
+  permission = permission_engine.compile(role)
   def wrapper(func):
     @wraps(func)
     def inner(*args, **kwargs):
-      session_cookie = request.cookies.get('session-mb')
+      session_cookie = get_session_cookie()
       if not session_cookie:
         # Session cookie is unavailable. Force user to login. can be a redirect
-        print("No session cookie")
         raise UnauthorizedException(description='Session cookie unavailable. Please login.')
-      check_permission(session_cookie, role)
+      check_permission(session_cookie, permission)
       return func(*args, **kwargs)
     return inner
   return wrapper
@@ -168,6 +408,25 @@ def create_user_or_raise(user_id: str, email: str, email_verified: bool, roles:
     raise RequestException(400, description='Failed to create user')
 
 
+def upsert_user_or_raise(user_id: str, email: str, email_verified: bool) -> dict|None:
+  """Create the user or refresh email_verified in one round trip
+  Args:
+    user_id (str): firebase user id
+    email (str): user email
+    email_verified (bool): email_verified claim from the token
+  Raises:
+    RequestException: the write failed, e.g email used by another user id
+  Returns:
+    dict|None: the user when inserted or updated, None when already up to date
+  """
+  try:
+    return User.upsert(user_id, email, email_verified)
+  except Exception:
+    db.session.rollback()
+    app.logger.error('Failed to upsert user', exc_info=True)
+    raise RequestException(400, description='Failed to create user')
+
+
 def get_user_by_filter_or_raise(user_id: str|int) -> User|None:
   try:
     user: User|None = User.query.filter_by(user_id=user_id).first()
@@ -1,21 +1,45 @@
+import time, hashlib
 from operator import itemgetter
-from flask import Blueprint, request, jsonify, make_response
-from firebase_admin import auth
+from flask import Blueprint, Response, request, jsonify, make_response, abort, current_app as app
+from ..batch import batch_verifier, verify_one, INVALID, EXPIRED, REVOKED, TRANSIENT
+from ...fast_json import dumps
 from . import require_authorization, validate_token_or_raise, get_user_by_filter_or_raise, \
 verify_session_or_raise, set_session_cookie_response_or_raise, create_user_or_raise,\
 is_payload_authtime_less, RequestException, UnauthorizedException,\
-get_session_cookie
+get_session_cookie, invalidate_session, upsert_user_or_raise, phase, rate_limited,\
+rejected_tokens, hash_secret, revocation_index, firebase_verify, throttle_or_raise, remember_rejection
 
 auth_bp = Blueprint('auth', __name__)
 
+# messages for verify_token and verify_tokens, by rejection reason
+TOKEN_REJECTIONS = {
+  INVALID: 'Invalid Token',
+  EXPIRED: 'Expired Token',
+  REVOKED: 'Revoked Token',
+  TRANSIENT: 'Invalid Token',
+}
+
 @auth_bp.route('/verify_session', methods=['GET'])
 def verify_session():
   session_cookie = get_session_cookie()
   user_payload = verify_session_or_raise(session_cookie)
-  return jsonify(user_payload)
+  # claims never change for a cookie, browsers may reuse the answer until it expires
+  with phase('json'):
+    body = dumps(user_payload, sort_keys=True) + b'\n'
+  etag = hashlib.sha1(body).hexdigest()[:20]
+  if etag in request.if_none_match:
+    response = Response(status=304)
+  else:
+    response = app.response_class(body, mimetype='application/json')
+  max_age = min(app.config.get('VERIFY_SESSION_MAX_AGE', 60), int(user_payload.get('exp', 0) - time.time()))
+  response.set_etag(etag)
+  response.headers['Cache-Control'] = f'private, max-age={max(0, max_age)}'
+  response.vary.add('Cookie')
+  return response
   
 
 @auth_bp.route('/sessionLogin', methods=['POST'])
+@rate_limited
 def signin():
   body = request.get_json()
   token, is_new_user = (body.get(key, None) for key in ["token", "is_new_user"])
@@ -29,37 +53,31 @@ def signin():
   user_id, email, email_verified, = \
     itemgetter('user_id', 'email', 'email_verified')(user_payload)
   
-  # try getting user to check if new user
-  user = get_user_by_filter_or_raise(user_id=user_id)
-  
-  if user:
-    # get session cookie and return
-    response = set_session_cookie_response_or_raise(user_payload, token)
-    return response
-  
-  # new user, get vars, create
-  user = create_user_or_raise(user_id, email, email_verified, [])
+  # create new user or refresh email_verified, single statement
+  upsert_user_or_raise(user_id, email, email_verified)
   
   # get session cookie and return
-  print("user: ", user.to_dict())
   response = set_session_cookie_response_or_raise(user_payload, token)
   return response
 
 
 @auth_bp.route('/sessionLogout', methods=['POST'])
 def signout():
-  session_cookie = request.cookies.get('session-mb')
+  session_cookie = get_session_cookie()
   if not session_cookie:
     # assume session is out?
     return jsonify({'message': 'No session_cookie provided'}), 200
+  # drop cached verification so the cookie stops working on this instance
+  invalidate_session(session_cookie)
   # delete session cookie
   response = make_response(jsonify({'status': 'Logged Out'}), 200)
   response.set_cookie(
-    'session-mb', expires=0, httponly=True, secure=True, samesite='None')
+    '_session_mb', expires=0, httponly=True, secure=True, samesite='None')
   return response
 
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limited
 def register():
   token = request.get_json()['token']
   #  check token
@@ -73,27 +91,68 @@ def register():
 
   # create user
   user = create_user_or_raise(user_payload['user_id'], user_payload['email'], user_payload['email_verified'], [])
-  print("user: ", user.to_dict())
+  app.logger.info('Registered user %s', user.user_id)
   response = set_session_cookie_response_or_raise(user_payload, token)
   return response
   
 
 @auth_bp.route('/verify_token', methods=['POST'])
+@rate_limited
 def verify_token():
   body = request.get_json()
   token = body.get('token', None)
   if not token:
     return jsonify({'message': 'No token provided'}), 400  
+  # recently rejected, skip verification
+  token_key = hash_secret(token)
+  reason = rejected_tokens.get(token_key)
+  if reason is not None:
+    return jsonify({'message': TOKEN_REJECTIONS[reason]})
   # verify token
+  with phase('firebase'), firebase_verify.guard():
+    valid, outcome = verify_one(token)
+  if valid:
+    if not revocation_index.is_revoked(outcome):
+      return jsonify({'message': 'token is valid'})
+    outcome = REVOKED
+  remember_rejection(token_key, outcome)
+  return jsonify({'message': TOKEN_REJECTIONS[outcome]})
+
+
+@auth_bp.route('/verify_tokens', methods=['POST'])
+def verify_tokens():
+  body = request.get_json()
+  tokens = body.get('tokens', None) if isinstance(body, dict) else None
+  if not isinstance(tokens, list) or not tokens or not all(isinstance(token, str) for token in tokens):
+    raise RequestException(description='Provide tokens as a non empty list of strings')
+  max_tokens = app.config.get('BATCH_VERIFY_MAX_TOKENS', 100)
+  if len(tokens) > max_tokens:
+    raise RequestException(description=f'At most {max_tokens} tokens per request')
+  # a batch costs as much as sending its tokens one by one
+  throttle_or_raise(len(tokens))
+  
+  # answer recently rejected tokens from the negative cache, verify the rest
+  keys = [hash_secret(token) for token in tokens]
+  results = [rejected_tokens.get(key) for key in keys]
+  pending = [index for index, reason in enumerate(results) if reason is None]
   try:
-    valid = auth.verify_id_token(token)
-  except auth.ExpiredIdTokenError:
-    return jsonify({'message': 'Expired Token'})
-  except auth.RevokedIdTokenError:
-    return jsonify({'message': 'Revoked Token'})
-  except auth.InvalidIdTokenError:
-    return jsonify({'message': 'Invalid Token'})
-  return jsonify({'message': 'token is valid'})
+    with phase('firebase'):
+      verified = batch_verifier.verify([tokens[index] for index in pending])
+  except Exception:
+    app.logger.error('Batch token verification failed', exc_info=True)
+    abort(503, description='Token verification unavailable, try again later')
+  
+  for index, (valid, outcome) in zip(pending, verified):
+    if valid and revocation_index.is_revoked(outcome):
+      valid, outcome = False, REVOKED
+    if valid:
+      results[index] = {'valid': True, 'claims': outcome}
+    else:
+      remember_rejection(keys[index], outcome)
+      results[index] = outcome
+  return jsonify({'results': [
+    result if isinstance(result, dict) else {'valid': False, 'message': TOKEN_REJECTIONS[result]} for result in results
+  ]})
 
 
 @auth_bp.route('/profile', methods=['GET', 'POST'])
@@ -1,42 +1,70 @@
 '''
   holds the blueprint routes for roles
 '''
-from typing import List
-from flask import Blueprint, jsonify, request
+from bisect import bisect_right
+from flask import Blueprint, Response, jsonify, request, current_app as app
 from firebase_admin import auth as fb_auth, exceptions
-from . import Role
+from . import Role, db, reload_permissions, firebase_admin_api, require_authorization
+from ..registry import role_registry
 
 # role bp wip
 role_bp = Blueprint('role', __name__)
 
-@role_bp.route('/', methods=['GET', 'POST'])
+# page size for GET /api/role/
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def roles_changed():
+  '''call after any write to roles'''
+  reload_permissions()
+
+
+@role_bp.route('/', methods=['GET'])
 def role():
-  if request.method == 'GET':
-    # get all roles
-    roles: List[Role] = Role.query.all()
-    return jsonify({'roles': [role.to_dict() for role in roles]})
-  elif request.method == 'POST':
-    body = request.get_json()
-    print(body)
-    new_role_name = body.get('role', None)
-    new_role_description = body.get('description', None)
-    
-    if not new_role_name:
-      return jsonify({'message': 'No role name provided'}), 400
-    
-    # verufy role does not exist
-    exist_role = Role.query.filter_by(name=new_role_name).first()
-    
-    if exist_role:
-      return jsonify({'message': 'Role already exists'}), 400
-    
-    # create role
-    try:
-      new_role = Role(name=new_role_name, description=new_role_description, level=0).save_instance()
-    except Exception as e:
-      print(e)
-      return jsonify({'message': 'Failed to create role'}), 400
-    return jsonify(new_role)
+  # keyset pagination over the cached list, ?after=<role_id>&limit=
+  after = request.args.get('after', type=int)
+  limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+  roles = role_registry.snapshot()
+  etag = f'{roles.version}-{after}-{limit}'
+  if etag in request.if_none_match:
+    # client copy is current, skip building the body
+    response = Response(status=304)
+  else:
+    start = bisect_right(roles.ids, after) if after is not None else 0
+    page = roles.roles[start:start + limit]
+    next_after = page[-1]['role_id'] if page and start + limit < len(roles.roles) else None
+    response = jsonify({'roles': page, 'next': next_after})
+  response.set_etag(etag)
+  response.headers['Cache-Control'] = 'private, no-cache'
+  return response
+
+
+@role_bp.route('/', methods=['POST'])
+@require_authorization(["Admin"])
+def create_role():
+  body = request.get_json()
+  new_role_name = body.get('role', None)
+  new_role_description = body.get('description', None)
+  
+  if not new_role_name:
+    return jsonify({'message': 'No role name provided'}), 400
+  
+  # known names are refused without a round trip, the insert catches the rest
+  if role_registry.lookup(new_role_name) is not None:
+    return jsonify({'message': 'Role already exists'}), 400
+  
+  # create role
+  try:
+    new_role = Role.create(new_role_name, new_role_description)
+  except Exception:
+    db.session.rollback()
+    app.logger.error('Failed to create role', exc_info=True)
+    return jsonify({'message': 'Failed to create role'}), 400
+  if new_role is None:
+    return jsonify({'message': 'Role already exists'}), 400
+  roles_changed()
+  return jsonify(new_role)
 
 
 @role_bp.route('/add_role', methods=['GET'])
@@ -44,31 +72,43 @@ def add_role():
   # update firebase claims
   try:
     # auth.set_custom_user_claims('Lzm5MyCVMddIp9XAejqwnSBJvPk2', {'Roles': ["Admin", "Verified"]})
-    fb_auth.update_user('Lzm5MyCVMddIp9XAejqwnSBJvPk2', custom_claims={'Roles': ["User"]})
+    with firebase_admin_api.guard():
+      fb_auth.update_user('Lzm5MyCVMddIp9XAejqwnSBJvPk2', custom_claims={'Roles': ["User"]})
   except ValueError:
     return jsonify({'message': 'Invalid User ID'})
   except exceptions.FirebaseError:
     return jsonify({'message': 'User not found'})
   
-  user = fb_auth.get_user('Lzm5MyCVMddIp9XAejqwnSBJvPk2')
-  print(user.custom_claims)
-  print(user.__dict__)
+  with firebase_admin_api.guard():
+    user = fb_auth.get_user('Lzm5MyCVMddIp9XAejqwnSBJvPk2')
+  app.logger.info('Updated claims for %s: %s', user.uid, user.custom_claims)
   return jsonify({'message': 'Role added'})
 
 
 @role_bp.route('/<role_name>', methods=['DELETE'])
+@require_authorization(["Admin"])
 def delete_role(role_name: str):
   # body = request.get_json()
   # # vars
   # role_name = body.get('role', None)
-  print(role_name)
   
   # checks
   if not role_name:
     return jsonify({'message': 'No Role name provided'}), 400
   
-  role: Role|None = Role.query.filter_by(name=role_name).delete()
-  
-  print(role)
+  role = role_registry.lookup(role_name)
+  if role is None:
+    return jsonify({'message': 'The provided role does not exist'})
   
-  return jsonify({'message': 'The provided role does not exist'})
\ No newline at end of file
+  try:
+    # drops assignments first, user_role references the role
+    deleted = Role.delete_by_id(role.role_id)
+  except Exception:
+    db.session.rollback()
+    app.logger.error('Failed to delete role', exc_info=True)
+    return jsonify({'message': 'Failed to delete role'}), 400
+  if not deleted:
+    roles_changed()
+    return jsonify({'message': 'The provided role does not exist'})
+  roles_changed()
+  return jsonify({'message': 'Role deleted'})
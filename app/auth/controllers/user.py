@@ -2,8 +2,43 @@
   holds the blueprint routes for users
 '''
 from flask import Blueprint, jsonify, request
-from firebase_admin import auth
-from . import User, Role
+from . import User, require_authorization, RequestException, revoke_user_sessions_or_raise
 
-# user bp wip
-user_bp = Blueprint('user', __name__)
\ No newline at end of file
+user_bp = Blueprint('user', __name__)
+
+# page size for GET /api/user/
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+@user_bp.route('/', methods=['GET'])
+@require_authorization(["Admin"])
+def list_users():
+  # keyset pagination on the primary key, ?after=<user_id>&limit=
+  after = request.args.get('after', None)
+  limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+  users = User.page(after, limit)
+  # roles for the whole page in one query
+  roles = User.role_names([user['user_id'] for user in users])
+  for user in users:
+    user['roles'] = roles[user['user_id']]
+  next_after = users[-1]['user_id'] if len(users) == limit else None
+  return jsonify({'users': users, 'next': next_after})
+
+
+@user_bp.route('/<user_id>', methods=['GET'])
+@require_authorization(["Admin"])
+def get_user(user_id: str):
+  users = User.page(limit=1, user_id=user_id)
+  if not users:
+    raise RequestException(404, 'not found', 'User not found')
+  user = users[0]
+  user['roles'] = User.role_names([user_id])[user_id]
+  return jsonify(user)
+
+
+@user_bp.route('/<user_id>/revoke', methods=['POST'])
+@require_authorization(["Admin"])
+def revoke_user(user_id: str):
+  valid_after = revoke_user_sessions_or_raise(user_id)
+  return jsonify({'message': 'Sessions revoked', 'valid_after': valid_after})
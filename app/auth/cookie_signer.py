@@ -0,0 +1,144 @@
+'''
+  Local session cookie minting with the service account key firebase was initialized with
+  cookies carry the same claims, issuer and audience firebase_admin expects, and are signed
+  with the service account key so verification only needs its public certificates, which
+  the key store serves alongside google's session cookie keys
+'''
+import time, logging, datetime, threading
+from urllib.parse import quote
+from typing import Any, Dict
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE_ISSUER = 'https://session.firebase.google.com/'
+SERVICE_ACCOUNT_CERT_URI = 'https://www.googleapis.com/robot/v1/metadata/x509/{}'
+
+# firebase accepts session cookies valid for 5 minutes up to 2 weeks
+MIN_EXPIRES_IN = 5 * 60
+MAX_EXPIRES_IN = 14 * 24 * 3600
+
+# claims set by the signer, or added by firebase_admin when decoding
+RESERVED_CLAIMS = frozenset(('iss', 'aud', 'iat', 'exp', 'nbf', 'uid'))
+
+mint_seconds = registry.histogram('session_cookie_mint_seconds', 'Time to mint a session cookie')
+_mint_series = {backend: mint_seconds.series(backend=backend) for backend in ('local', 'firebase')}
+
+
+def observe_mint(backend: str, seconds: float):
+  mint_seconds.observe_series(_mint_series[backend], seconds)
+
+
+class SessionCookieSigner:
+  '''
+    Holds the active signing key, load() swaps it atomically so keys can rotate while serving
+    cookies signed with the previous key keep verifying for as long as google publishes its certificate
+  '''
+  def __init__(self):
+    self.project_id: str|None = None
+    self._signer = None
+    self._lock = threading.Lock()
+
+  @property
+  def ready(self) -> bool:
+    return self._signer is not None
+
+  @property
+  def key_id(self) -> str|None:
+    return self._signer.key_id if self._signer is not None else None
+
+  def can_mint(self) -> bool:
+    '''a key is loaded and its certificate is served, so the cookie will verify'''
+    from .keystore import key_store, COOKIE_CERT_URI
+
+    signer = self._signer
+    return signer is not None and key_store.has_key(COOKIE_CERT_URI, signer.key_id)
+
+  def load(self, credential, project_id: str) -> bool:
+    """Use the key of a google service account credential
+    Args:
+      credential: google.oauth2.service_account.Credentials, from the firebase app credential
+      project_id (str): firebase project the cookies are for
+    Returns:
+      bool: False when the credential cannot sign locally, e.g app engine default credentials
+    """
+    from google.oauth2 import service_account
+
+    if not isinstance(credential, service_account.Credentials) or not project_id:
+      return False
+    with self._lock:
+      self._signer = credential.signer
+      self.project_id = project_id
+    return True
+
+  def mint(self, claims: Dict[str, Any], expires_in: datetime.timedelta|int) -> str:
+    """Sign a session cookie for verified id token claims
+    Args:
+      claims (Dict[str, Any]): decoded id token, as returned by verify_id_token
+      expires_in (datetime.timedelta|int): cookie lifetime
+    Raises:
+      ValueError: no key loaded or lifetime out of bounds
+    Returns:
+      str: session cookie
+    """
+    from google.auth import jwt
+
+    signer, project_id = self._signer, self.project_id
+    if signer is None:
+      raise ValueError('No session cookie signing key loaded')
+    if isinstance(expires_in, datetime.timedelta):
+      expires_in = int(expires_in.total_seconds())
+    if not MIN_EXPIRES_IN <= expires_in <= MAX_EXPIRES_IN:
+      raise ValueError('expires_in must be between 5 minutes and 2 weeks')
+    started = time.perf_counter()
+    now = int(time.time())
+    payload = {key: value for key, value in claims.items() if key not in RESERVED_CLAIMS}
+    payload.update({
+      'iss': SESSION_COOKIE_ISSUER + project_id,
+      'aud': project_id,
+      'iat': now,
+      'exp': now + expires_in,
+    })
+    # key_id defaults to the signer's, the service account private_key_id
+    cookie = jwt.encode(signer, payload).decode('utf-8')
+    observe_mint('local', time.perf_counter() - started)
+    return cookie
+
+
+# process wide signer
+cookie_signer = SessionCookieSigner()
+
+
+def setup_cookie_signer(firebase_app=None, fetch_certs: bool = True, local_signing: bool = True) -> bool:
+  """Serve the firebase app's service account certificates with the cookie keys and load its key
+  the certificates are trusted whenever the service account is known, cookies minted by another
+  instance with local signing on keep verifying here whatever this instance does
+  Args:
+    firebase_app: firebase app, default app if None
+    fetch_certs (bool): fetch the service account certificates now, off when keys come from a file
+    local_signing (bool): mint cookies with the service account key
+  Returns:
+    bool: True if cookies are minted locally
+  """
+  import firebase_admin
+  from .keystore import key_store, COOKIE_CERT_URI
+
+  fb_app = firebase_app or firebase_admin.get_app()
+  credential = fb_app.credential.get_credential()
+  email = getattr(credential, 'service_account_email', None) or fb_app.options.get('serviceAccountId')
+  # compute engine credentials say 'default' until refreshed
+  if email and '@' in email:
+    cert_url = SERVICE_ACCOUNT_CERT_URI.format(quote(email))
+    key_store.merge(COOKIE_CERT_URI, cert_url, name='service_account' if fetch_certs else None)
+    if fetch_certs:
+      try:
+        key_store.fetch(cert_url)
+      except Exception:
+        # the refresh thread retries, verification refetches for an unknown kid
+        logger.warning('Failed to fetch service account certificates', exc_info=True)
+  if not local_signing:
+    return False
+  if not cookie_signer.load(credential, fb_app.project_id):
+    logger.info('Credential cannot sign locally, session cookies are minted by firebase')
+    return False
+  return True
@@ -0,0 +1,314 @@
+'''
+  In memory store for the public certificates firebase tokens and session cookies are signed with.
+  Keys are prefetched at startup and refreshed in a background thread ahead of their
+  Cache-Control expiry, so token verification never waits on the network.
+'''
+import re, json, time, logging, threading
+from typing import Any, Callable, Dict, List
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# same endpoints firebase_admin verifies against
+ID_TOKEN_CERT_URI = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+COOKIE_CERT_URI = 'https://www.googleapis.com/identitytoolkit/v3/relyingparty/publicKeys'
+
+# names used in local key files
+KEY_SETS = {
+  'id_token': ID_TOKEN_CERT_URI,
+  'session_cookie': COOKIE_CERT_URI,
+}
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+# google.auth message when a token's kid is not in the certificates it was given
+UNKNOWN_KEY_ERROR = 'Certificate for key id'
+
+
+class _KeyResponse:
+  '''minimal google.auth.transport.Response served from memory'''
+  def __init__(self, data: bytes):
+    self.status = 200
+    self.headers = {'content-type': 'application/json'}
+    self.data = data
+
+
+class KeyStoreRequest:
+  '''
+    google.auth transport request that answers certificate fetches from the key store
+    and hands everything else to the original transport
+  '''
+  def __init__(self, store: 'SigningKeyStore', fallback: Callable):
+    self.store = store
+    self.fallback = fallback
+
+  def __call__(self, url: str, method: str = 'GET', body=None, headers=None, timeout=None, **kwargs):
+    if method == 'GET':
+      data = self.store.get_raw(url)
+      if data is not None:
+        return _KeyResponse(data)
+    # google.auth waits up to 120s by default
+    timeout = timeout if timeout is not None else self.store.fetch_timeout
+    return self.fallback(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+
+class SigningKeyStore:
+  '''
+    Holds the certificate sets keyed by url, along with when each set should be refreshed
+  '''
+  def __init__(self, urls: Dict[str, str]|None = None, fetch_timeout: float = 5,
+               refresh_ratio: float = 0.8, min_refresh: int = 60, retry_after: int = 30,
+               refetch_interval: float|None = 10):
+    self.urls = dict(urls if urls is not None else KEY_SETS)
+    self.fetch_timeout = fetch_timeout
+    self.refresh_ratio = refresh_ratio
+    self.min_refresh = min_refresh
+    self.retry_after = retry_after
+    # seconds between refetches for unknown kids, None when the loaded keys are all there is
+    self.refetch_interval = refetch_interval
+    self.refresh_failures = 0
+    self._keys: Dict[str, Dict[str, str]] = {}
+    self._raw: Dict[str, bytes] = {}
+    self._served: Dict[str, Dict[str, str]] = {}
+    # url -> extra urls whose keys are served along with its own
+    self._merged: Dict[str, List[str]] = {}
+    self._refresh_at: Dict[str, float] = {}
+    self._refetched_at: Dict[str, float] = {}
+    self._lock = threading.Lock()
+    self._refetch_lock = threading.Lock()
+    self._stop = threading.Event()
+    self._thread: threading.Thread|None = None
+
+  def set_keys(self, url: str, keys: Dict[str, str], max_age: int|None = None):
+    """Replace the certificates served for url
+    Args:
+      url (str): certificate endpoint the keys belong to
+      keys (Dict[str, str]): key id to PEM certificate
+      max_age (int|None): seconds the keys are valid for, None never refreshes
+    """
+    with self._lock:
+      self._keys[url] = dict(keys)
+      self._rebuild_raw(url)
+      for target, sources in self._merged.items():
+        if url in sources:
+          self._rebuild_raw(target)
+      if max_age is None:
+        self._refresh_at[url] = float('inf')
+      else:
+        self._refresh_at[url] = time.time() + max(self.min_refresh, max_age * self.refresh_ratio)
+
+  def _rebuild_raw(self, url: str):
+    '''serialized response for url, its own keys win over merged ones. Caller holds the lock'''
+    keys: Dict[str, str] = {}
+    for source in self._merged.get(url, ()):
+      keys.update(self._keys.get(source, {}))
+    keys.update(self._keys.get(url, {}))
+    if url in self._keys or keys:
+      self._served[url] = keys
+      self._raw[url] = json.dumps(keys).encode('utf-8')
+
+  def merge(self, target: str, source: str, name: str|None = None):
+    """Serve the keys published at source as part of target
+    e.g the service account certificates locally minted session cookies are signed with
+    Args:
+      target (str): url firebase_admin fetches
+      source (str): extra certificate url
+      name (str|None): key set name, source is refreshed with the others when given
+    """
+    with self._lock:
+      sources = self._merged.setdefault(target, [])
+      if source not in sources:
+        sources.append(source)
+      self._rebuild_raw(target)
+      if name is not None:
+        self.urls = {**self.urls, name: source}
+
+  def get_keys(self, url: str) -> Dict[str, str]|None:
+    return self._keys.get(url)
+
+  def get_raw(self, url: str) -> bytes|None:
+    return self._raw.get(url)
+
+  def has_key(self, url: str, kid: str) -> bool:
+    '''True if tokens signed with kid verify against url, merged keys included'''
+    return kid in self._served.get(url, ())
+
+  def load_file(self, path: str):
+    """Load key sets from a json file, for offline use and tests
+    The file maps a key set name (id_token, session_cookie) or url to {kid: pem}
+    Args:
+      path (str): path to the json file
+    """
+    with open(path) as key_file:
+      key_sets: Dict[str, Dict[str, str]] = json.load(key_file)
+    for name, keys in key_sets.items():
+      self.set_keys(KEY_SETS.get(name, name), keys)
+
+  def fetch(self, url: str):
+    '''fetch one key set from google, raises on failure'''
+    import requests
+
+    response = requests.get(url, timeout=self.fetch_timeout)
+    response.raise_for_status()
+    match = MAX_AGE_RE.search(response.headers.get('Cache-Control', ''))
+    self.set_keys(url, response.json(), int(match.group(1)) if match else 0)
+
+  def refresh(self, force: bool = False) -> bool:
+    """Refresh every key set that is due
+    Args:
+      force (bool): refresh regardless of expiry
+    Returns:
+      bool: True if every due key set was refreshed
+    """
+    ok = True
+    now = time.time()
+    for url in self.urls.values():
+      if not force and self._refresh_at.get(url, 0) > now:
+        continue
+      try:
+        self.fetch(url)
+      except Exception:
+        ok = False
+        self.refresh_failures += 1
+        # keep serving what we have, google keeps old keys published past max-age
+        with self._lock:
+          self._refresh_at[url] = now + self.retry_after
+        logger.warning('Failed to refresh signing keys from %s', url, exc_info=True)
+    return ok
+
+  def ensure_key(self, url: str, kid: str) -> bool:
+    """Refetch url and its merged sources when kid is not served
+    keys rotated ahead of the scheduled refresh, or the startup fetch failed, at most once per
+    refetch_interval so tokens with made up kids cannot hammer google
+    Args:
+      url (str): certificate endpoint the token verifies against
+      kid (str): key id from the token header
+    Returns:
+      bool: True if kid is served now
+    """
+    if self.has_key(url, kid):
+      return True
+    if self.refetch_interval is None:
+      return False
+    with self._refetch_lock:
+      # another thread may have fetched it while we waited
+      if self.has_key(url, kid):
+        return True
+      now = time.monotonic()
+      if now - self._refetched_at.get(url, float('-inf')) < self.refetch_interval:
+        return False
+      self._refetched_at[url] = now
+      refreshable = set(self.urls.values())
+      for source in [url, *self._merged.get(url, ())]:
+        if source not in refreshable:
+          continue
+        try:
+          self.fetch(source)
+        except Exception:
+          self.refresh_failures += 1
+          logger.warning('Failed to refetch signing keys from %s', source, exc_info=True)
+    return self.has_key(url, kid)
+
+  def verify(self, url: str, verify: Callable[[str], Dict[str, Any]], token: str) -> Dict[str, Any]:
+    """Run verify(token), once more after a refetch when the token's kid is not served
+    Args:
+      url (str): certificate endpoint verify fetches
+      verify (Callable): firebase_admin verify function, e.g fb_auth.verify_id_token
+      token (str): id token or session cookie
+    Returns:
+      Dict[str, Any]: decoded claims
+    """
+    from google.auth import jwt
+
+    try:
+      return verify(token)
+    except Exception as e:
+      if UNKNOWN_KEY_ERROR not in str(e):
+        raise
+      # only tokens that parsed far enough to name a kid get here
+      if not self.ensure_key(url, jwt.decode_header(token).get('kid')):
+        raise
+    return verify(token)
+
+  def next_refresh(self) -> float:
+    with self._lock:
+      due = [self._refresh_at.get(url, 0) for url in self.urls.values()]
+    return min(due) if due else float('inf')
+
+  def _run(self):
+    while not self._stop.is_set():
+      wait = self.next_refresh() - time.time()
+      if wait > 0:
+        # wake up at least once a minute in case new key sets were added
+        self._stop.wait(min(wait, 60))
+        continue
+      self.refresh()
+
+  def start(self):
+    '''start the background refresh thread, once per process'''
+    if self._thread is not None and self._thread.is_alive():
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, name='signing-key-refresh', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+
+  def install(self, firebase_app=None):
+    """Route firebase_admin certificate fetches through the store
+    Args:
+      firebase_app: firebase app, default app if None
+    """
+    from firebase_admin import auth as fb_auth
+
+    verifier = fb_auth._get_client(firebase_app)._token_verifier
+    if isinstance(verifier.request, KeyStoreRequest):
+      verifier.request.store = self
+      return
+    verifier.request = KeyStoreRequest(self, verifier.request)
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      'key_sets': {url: len(keys) for url, keys in self._keys.items()},
+      'next_refresh': self.next_refresh(),
+      'refresh_failures': self.refresh_failures,
+    }
+
+
+# process wide store
+key_store = SigningKeyStore()
+registry.gauge('signing_keys', 'Certificates loaded per key set',
+  lambda: {(('url', url),): count for url, count in key_store.stats()['key_sets'].items()})
+registry.gauge('signing_keys_next_refresh', 'Unix time the next key set is due for refresh',
+  lambda: key_store.stats()['next_refresh'])
+registry.gauge('signing_keys_refresh_failures', 'Failed key set fetches', lambda: key_store.stats()['refresh_failures'])
+
+
+def setup_keystore(firebase_app=None, key_file: str|None = None, background_refresh: bool = True,
+                   fetch_timeout: float = 5, prefetch: bool = True,
+                   refetch_interval: float|None = 10) -> SigningKeyStore:
+  """Prefetch the signing keys and hook the store into firebase_admin
+  Args:
+    firebase_app: firebase app, default app if None
+    key_file (str|None): load keys from this file instead of the network
+    background_refresh (bool): keep keys fresh in a background thread
+    fetch_timeout (float): seconds to wait on google when fetching keys
+    prefetch (bool): fetch now, otherwise the background thread fetches right away
+    refetch_interval (float|None): seconds between refetches for tokens with an unknown kid
+  Returns:
+    SigningKeyStore: the process wide store
+  """
+  key_store.fetch_timeout = fetch_timeout
+  if key_file:
+    key_store.load_file(key_file)
+    # a file is all there is, an unknown kid is just an invalid token
+    key_store.refetch_interval = None
+  else:
+    if prefetch or not background_refresh:
+      key_store.refresh(force=True)
+    if background_refresh:
+      key_store.start()
+    key_store.refetch_interval = refetch_interval
+  key_store.install(firebase_app)
+  return key_store
@@ -1,10 +1,13 @@
 '''
   Models for user
 '''
+import time
 from app import db
+from app.db_routing import pin_primary
 from sqlalchemy.ext.hybrid import hybrid_property, Comparator
 from sqlalchemy import func
 from sqlalchemy.ext.declarative import declarative_base
+from typing import Dict, List, Tuple
 
 Base = declarative_base()
 
@@ -45,8 +48,70 @@ class User(db.Model):
     db.session.commit()
     return self.to_dict()
   
+  @classmethod
+  def upsert(cls, user_id: str, email: str, email_verified: bool) -> dict|None:
+    '''
+      Insert the user or refresh email_verified in a single statement
+      returns the row when it was inserted or changed, None when it was already up to date
+    '''
+    table = cls.__table__
+    if db.engine.dialect.name == 'postgresql':
+      from sqlalchemy.dialects.postgresql import insert
+      
+      stmt = insert(table).values(user_id=user_id, email=email, email_verified=email_verified)
+      stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={'email_verified': stmt.excluded.email_verified},
+        # skip the write entirely on the common, unchanged login
+        where=table.c.email_verified.is_distinct_from(stmt.excluded.email_verified),
+      ).returning(table.c.user_id, table.c.username, table.c.email, table.c.email_verified)
+      row = db.session.execute(stmt).first()
+      db.session.commit()
+      return dict(row._mapping) if row is not None else None
+    # other dialects, select on the primary then write
+    pin_primary()
+    user = cls.query.get(user_id)
+    if user is None:
+      user = cls(user_id=user_id, email=email, email_verified=email_verified)
+      db.session.add(user)
+    elif user.email_verified == email_verified:
+      return None
+    else:
+      user.email_verified = email_verified
+    db.session.commit()
+    return user.to_dict()
+  
   def get_roles(self):
     return [role for role in self.roles]
+  
+  @classmethod
+  def page(cls, after: str|None = None, limit: int = 100, user_id: str|None = None) -> List[dict]:
+    '''
+      Keyset page of users ordered by user_id, loads plain columns only, no orm instances
+    '''
+    query = db.session.query(cls.user_id, cls.username, cls.email, cls.email_verified)
+    if user_id is not None:
+      query = query.filter(cls.user_id == user_id)
+    if after is not None:
+      query = query.filter(cls.user_id > after)
+    return [row._asdict() for row in query.order_by(cls.user_id).limit(limit)]
+  
+  @staticmethod
+  def role_names(user_ids: List[str]) -> Dict[str, List[str]]:
+    '''
+      Sorted role names for each user id, one query for the whole batch
+    '''
+    roles: Dict[str, List[str]] = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+      return roles
+    rows = db.session.query(user_role.c.user_id, Role.name)\
+      .join(Role, Role.role_id == user_role.c.role_id)\
+      .filter(user_role.c.user_id.in_(user_ids))
+    for user_id, name in rows:
+      roles[user_id].append(name)
+    for names in roles.values():
+      names.sort()
+    return roles
 
   def to_dict(self):
     return {
@@ -70,6 +135,11 @@ class Role(db.Model):
   name = db.Column(db.String(128), nullable=False, unique=True)
   description = db.Column(db.String, nullable=False)
   level = db.Column(db.Integer, nullable=False, default=0)
+  
+  # names are unique regardless of case, also serves i_name lookups
+  __table_args__ = (
+    db.Index('ix_roles_lower_name', func.lower(name), unique=True),
+  )
 
   def __init__(self, name: str, description: str, level: int):
     self.name = name
@@ -80,6 +150,43 @@ class Role(db.Model):
     db.session.add(self)
     db.session.commit()
     return self.to_dict()
+  
+  @classmethod
+  def create(cls, name: str, description: str|None, level: int = 0) -> dict|None:
+    '''
+      Insert the role in a single statement
+      returns the new role, None when a role with the same name in any case exists
+    '''
+    table = cls.__table__
+    description = description if description else "base"
+    if db.engine.dialect.name == 'postgresql':
+      from sqlalchemy.dialects.postgresql import insert
+      
+      # no conflict target, covers both name and lower(name)
+      stmt = insert(table).values(name=name, description=description, level=level)\
+        .on_conflict_do_nothing()\
+        .returning(table.c.role_id, table.c.name, table.c.description)
+      row = db.session.execute(stmt).first()
+      db.session.commit()
+      return dict(row._mapping) if row is not None else None
+    # other dialects, rely on the unique indexes
+    from sqlalchemy.exc import IntegrityError
+    
+    try:
+      return cls(name=name, description=description, level=level).save_instance()
+    except IntegrityError:
+      db.session.rollback()
+      return None
+  
+  @classmethod
+  def delete_by_id(cls, role_id: int) -> bool:
+    '''
+      Delete the role and its assignments, False when it no longer exists
+    '''
+    db.session.execute(user_role.delete().where(user_role.c.role_id == role_id))
+    deleted = db.session.execute(cls.__table__.delete().where(cls.role_id == role_id)).rowcount
+    db.session.commit()
+    return deleted > 0
 
   def to_dict(self):
     return {
@@ -98,4 +205,64 @@ class Role(db.Model):
   
   def __repr__(self):
     return f'<Role id:{self.role_id} name:{self.name}>'
-  
\ No newline at end of file
+  
+
+
+class TokenRevocation(db.Model):
+  '''
+    Tokens and session cookies issued before valid_after (unix seconds) are revoked
+    recorded_at is when the row was last written, processes refresh by it since a revocation
+    copied in from firebase can carry a valid_after well in the past
+  '''
+  __tablename__ = 'token_revocations'
+
+  user_id = db.Column(db.String, primary_key=True)
+  valid_after = db.Column(db.Integer, nullable=False, index=True)
+  recorded_at = db.Column(db.Integer, nullable=False, index=True)
+
+  def __init__(self, user_id: str, valid_after: int, recorded_at: int|None = None):
+    self.user_id = user_id
+    self.valid_after = valid_after
+    self.recorded_at = recorded_at if recorded_at is not None else int(time.time())
+
+  @classmethod
+  def record(cls, user_id: str, valid_after: int):
+    '''
+      Insert or move valid_after forward in one statement, an older value never wins
+    '''
+    table = cls.__table__
+    recorded_at = int(time.time())
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+      if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+      else:
+        from sqlalchemy.dialects.sqlite import insert
+      
+      stmt = insert(table).values(user_id=user_id, valid_after=valid_after, recorded_at=recorded_at)
+      stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={'valid_after': stmt.excluded.valid_after, 'recorded_at': stmt.excluded.recorded_at},
+        where=table.c.valid_after < stmt.excluded.valid_after,
+      )
+      db.session.execute(stmt)
+      db.session.commit()
+      return
+    # other dialects, read the current row from the primary then write
+    pin_primary()
+    revocation = cls.query.get(user_id)
+    if revocation is None:
+      db.session.add(cls(user_id=user_id, valid_after=valid_after, recorded_at=recorded_at))
+    elif revocation.valid_after < valid_after:
+      revocation.valid_after = valid_after
+      revocation.recorded_at = recorded_at
+    db.session.commit()
+
+  @classmethod
+  def since(cls, recorded_at: int, valid_after: int = 0) -> List[Tuple[str, int, int]]:
+    '''(user_id, valid_after, recorded_at) written at or after recorded_at and still within valid_after'''
+    return db.session.query(cls.user_id, cls.valid_after, cls.recorded_at)\
+      .filter(cls.recorded_at >= recorded_at, cls.valid_after >= valid_after).all()
+
+  def __repr__(self):
+    return f'<TokenRevocation user_id:{self.user_id} valid_after:{self.valid_after}>'
@@ -0,0 +1,88 @@
+'''
+  Role hierarchy permission engine
+  roles come from the role registry, a role implies every role with a lower level
+'''
+import logging, threading
+from typing import Dict, FrozenSet, Iterable, List
+from .registry import role_registry
+
+logger = logging.getLogger(__name__)
+
+
+class Permission:
+  '''
+    Roles accepted by an endpoint, compiled once when the decorator is applied.
+    The expanded set of granting roles is cached per hierarchy version.
+  '''
+  __slots__ = ('roles', 'granted', 'version')
+
+  def __init__(self, roles: Iterable[str]):
+    self.roles: FrozenSet[str] = frozenset(roles)
+    self.granted: FrozenSet[str] = self.roles
+    self.version = -1
+
+  def __repr__(self):
+    return f'<Permission roles:{sorted(self.roles)}>'
+
+
+class PermissionEngine:
+  def __init__(self):
+    self.version = 0
+    self._registry_version: str|None = None
+    self._lock = threading.Lock()
+
+  def compile(self, role: str|List[str]|Permission) -> Permission:
+    if isinstance(role, Permission):
+      return role
+    if isinstance(role, str):
+      role = [role]
+    return Permission(role)
+
+  def load(self) -> Dict[str, int]:
+    '''role levels from the role registry, needs an app context'''
+    try:
+      snapshot = role_registry.snapshot()
+    except Exception:
+      # exact role matches still work without the hierarchy, try again next check
+      logger.error('Failed to load role hierarchy', exc_info=True)
+      return {}
+    if snapshot.version != self._registry_version:
+      # compiled permissions expand again against the new hierarchy
+      with self._lock:
+        if snapshot.version != self._registry_version:
+          self._registry_version = snapshot.version
+          self.version += 1
+    return snapshot.levels
+
+  def reload(self):
+    '''drop the loaded hierarchy, the next check reloads it'''
+    role_registry.invalidate()
+
+  def granted_roles(self, permission: Permission) -> FrozenSet[str]:
+    """Every role that satisfies the permission
+    a role grants the permission when it is required, or its level is higher than the
+    lowest level among the required roles
+    """
+    levels = self.load()
+    if permission.version == self.version:
+      return permission.granted
+    required = [levels[name] for name in permission.roles if name in levels]
+    if required:
+      threshold = min(required)
+      granted = permission.roles | {name for name, level in levels.items() if level > threshold}
+    else:
+      granted = permission.roles
+    permission.granted = frozenset(granted)
+    permission.version = self.version
+    return permission.granted
+
+  def allows(self, permission: Permission, user_roles: Iterable[str]) -> bool:
+    return not self.granted_roles(permission).isdisjoint(user_roles)
+
+
+# process wide engine
+permission_engine = PermissionEngine()
+
+
+def reload_permissions():
+  permission_engine.reload()
@@ -0,0 +1,72 @@
+'''
+  In memory registry of the roles table
+  one query loads every role, serving case insensitive name lookups, the GET /api/role/ list
+  and the levels the permission engine expands, invalidated on writes in this process and
+  reloaded by other workers after ttl seconds
+'''
+import json, time, hashlib, threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List
+
+
+@dataclass(frozen=True)
+class RoleEntry:
+  role_id: int
+  name: str
+  description: str
+  level: int
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      "role_id": self.role_id,
+      "name": self.name,
+      "description": self.description
+    }
+
+
+class RoleSnapshot:
+  '''immutable view of the roles table, swapped whole on reload'''
+  __slots__ = ('version', 'roles', 'ids', 'by_name', 'levels')
+
+  def __init__(self, entries: List[RoleEntry]):
+    entries = sorted(entries, key=lambda entry: entry.role_id)
+    self.roles: List[Dict[str, Any]] = [entry.to_dict() for entry in entries]
+    self.ids: List[int] = [entry.role_id for entry in entries]
+    self.by_name: Dict[str, RoleEntry] = {entry.name.lower(): entry for entry in entries}
+    self.levels: Dict[str, int] = {entry.name: entry.level for entry in entries}
+    # content derived, so every worker hands out the same version for the same roles
+    content = json.dumps([asdict(entry) for entry in entries], sort_keys=True).encode('utf-8')
+    self.version = hashlib.sha1(content).hexdigest()[:16]
+
+
+class RoleRegistry:
+  def __init__(self, ttl: int = 30):
+    self.ttl = ttl
+    self._snapshot: RoleSnapshot|None = None
+    self._expires_at = 0.0
+    self._lock = threading.Lock()
+
+  def snapshot(self) -> RoleSnapshot:
+    '''current roles, reloaded from the db when expired, needs an app context'''
+    if self._snapshot is not None and self._expires_at > time.time():
+      return self._snapshot
+    from .models import Role
+    from .. import db
+
+    with self._lock:
+      if self._snapshot is None or self._expires_at <= time.time():
+        rows = db.session.query(Role.role_id, Role.name, Role.description, Role.level)
+        self._snapshot = RoleSnapshot([RoleEntry(*row) for row in rows])
+        self._expires_at = time.time() + self.ttl
+      return self._snapshot
+
+  def lookup(self, name: str) -> RoleEntry|None:
+    '''case insensitive, same rule as the unique index on lower(name)'''
+    return self.snapshot().by_name.get(name.lower())
+
+  def invalidate(self):
+    self._expires_at = 0.0
+
+
+# process wide registry
+role_registry = RoleRegistry()
@@ -0,0 +1,123 @@
+'''
+  Local index of per user tokens_valid_after_time
+  lets session and token verification enforce revocation with a dict lookup instead of a
+  firebase user lookup; every process refreshes it incrementally from token_revocations
+
+  token_revocations is written by POST /api/user/<user_id>/revoke right away. Revocations made
+  outside this app, from the firebase console, another admin sdk or a password reset, only land
+  there when `flask app sync-revocations` runs, and are not enforced until then. Run it on a
+  schedule shorter than the exposure you can accept
+'''
+import time, logging, threading
+from typing import Any, Dict, Iterator, Tuple
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationIndex:
+  def __init__(self, refresh_interval: int = 30, overlap: int = 300, max_age: int = 14 * 24 * 3600):
+    # overlap re-reads rows recorded shortly before the watermark, for clock skew between instances
+    self.refresh_interval = refresh_interval
+    self.overlap = overlap
+    # no session cookie lives longer than this, older revocations can be forgotten
+    self.max_age = max_age
+    self._valid_after: Dict[str, int] = {}
+    self._watermark = 0
+    self._next_refresh = 0.0
+    self._lock = threading.Lock()
+
+  def configure(self, refresh_interval: int, overlap: int, max_age: int):
+    with self._lock:
+      self.refresh_interval = refresh_interval
+      self.overlap = overlap
+      self.max_age = max_age
+      self._next_refresh = 0.0
+
+  def refresh(self, force: bool = False):
+    '''pull revocations newer than the watermark, needs an app context'''
+    if not force and self._next_refresh > time.time():
+      return
+    from .models import TokenRevocation
+
+    # one thread refreshes, the others keep using the current index
+    if not self._lock.acquire(blocking=force):
+      return
+    try:
+      now = int(time.time())
+      cutoff = now - self.max_age
+      # the watermark follows write order, a revocation synced from firebase is written
+      # now but can carry a valid_after far behind revocations already loaded
+      since = self._watermark - self.overlap if self._watermark else 0
+      try:
+        rows = TokenRevocation.since(since, cutoff)
+      except Exception:
+        logger.error('Failed to refresh revocation index', exc_info=True)
+        self._next_refresh = time.time() + self.refresh_interval
+        return
+      valid_after = dict(self._valid_after)
+      for user_id, timestamp, recorded_at in rows:
+        if timestamp > valid_after.get(user_id, 0):
+          valid_after[user_id] = timestamp
+        self._watermark = max(self._watermark, recorded_at)
+      self._valid_after = {user_id: timestamp for user_id, timestamp in valid_after.items() if timestamp >= cutoff}
+      self._next_refresh = time.time() + self.refresh_interval
+    finally:
+      self._lock.release()
+
+  def record(self, user_id: str, valid_after: int):
+    '''apply a revocation made by this process right away'''
+    with self._lock:
+      if valid_after > self._valid_after.get(user_id, 0):
+        self._valid_after = {**self._valid_after, user_id: valid_after}
+
+  def is_revoked(self, claims: Dict[str, Any]) -> bool:
+    """True if the token or cookie was issued before the user's sessions were revoked
+    same rule firebase_admin applies with check_revoked=True
+    """
+    self.refresh()
+    valid_after = self._valid_after.get(claims.get('uid') or claims.get('sub'))
+    return valid_after is not None and claims.get('iat', 0) < valid_after
+
+  def stats(self) -> Dict[str, int]:
+    return {'size': len(self._valid_after), 'watermark': self._watermark}
+
+
+revocation_index = RevocationIndex()
+registry.gauge('revocation_index_size', 'Users with a revocation in the index',
+  lambda: revocation_index.stats()['size'])
+registry.gauge('revocation_index_watermark', 'Latest recorded_at loaded into the index',
+  lambda: revocation_index.stats()['watermark'])
+
+# firebase page size for list_users
+FIREBASE_PAGE_SIZE = 1000
+
+
+def iter_firebase_revocations(max_age: int, client=None) -> Iterator[Tuple[str, int]]:
+  """Page through every firebase user, yield (uid, valid_after) for users revoked within max_age
+  firebase sets tokens_valid_after at creation, only a later value means a revocation
+  """
+  if client is None:
+    from firebase_admin import auth as client
+
+  cutoff = int(time.time()) - max_age
+  for user in client.list_users(max_results=FIREBASE_PAGE_SIZE).iterate_all():
+    if not user.tokens_valid_after_timestamp:
+      continue
+    valid_after = user.tokens_valid_after_timestamp // 1000
+    created = (user.user_metadata.creation_timestamp or 0) // 1000
+    if valid_after > created + 1 and valid_after >= cutoff:
+      yield user.uid, valid_after
+
+
+def sync_revocations(max_age: int|None = None, client=None) -> Dict[str, int]:
+  '''copy revocations made outside this app into token_revocations, needs an app context'''
+  from .models import TokenRevocation
+
+  synced = 0
+  max_age = revocation_index.max_age if max_age is None else max_age
+  for user_id, valid_after in iter_firebase_revocations(max_age, client):
+    # never moves valid_after back, a no-op for revocations made through this app
+    TokenRevocation.record(user_id, valid_after)
+    synced += 1
+  return {'synced': synced}
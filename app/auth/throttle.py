@@ -0,0 +1,68 @@
+'''
+  Per client token bucket, rejects a client before any token verification work is done
+'''
+import math, time, threading
+from collections import OrderedDict
+from typing import List
+from ..metrics import registry
+
+
+class TokenBucketLimiter:
+  '''
+    rate tokens per second refill each client's bucket up to burst
+    only the most recent max_clients are tracked, an evicted client starts with a full bucket
+  '''
+  def __init__(self, rate: float = 5, burst: int = 20, max_clients: int = 10000):
+    self.rate = rate
+    self.burst = burst
+    self.max_clients = max_clients
+    self.rejected = 0
+    self._buckets: OrderedDict[str, List[float]] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def configure(self, rate: float, burst: int, max_clients: int):
+    with self._lock:
+      self.rate = rate
+      self.burst = burst
+      self.max_clients = max_clients
+      self._buckets.clear()
+
+  def allow(self, client: str, cost: int = 1) -> float:
+    """Take cost tokens for the client
+    a cost above burst is allowed from a full bucket and leaves it in debt, so large
+    requests are charged in full without being refused forever
+    Args:
+      client (str): client key, the remote address
+      cost (int): tokens to take, e.g the number of tokens in a batch
+    Returns:
+      float: 0 if allowed, otherwise seconds until enough tokens are available
+    """
+    if self.rate <= 0:
+      return 0
+    now = time.monotonic()
+    needed = min(cost, self.burst)
+    with self._lock:
+      bucket = self._buckets.get(client)
+      if bucket is None:
+        bucket = self._buckets[client] = [float(self.burst), now]
+        if len(self._buckets) > self.max_clients:
+          self._buckets.popitem(last=False)
+      else:
+        self._buckets.move_to_end(client)
+        bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+      if bucket[0] >= needed:
+        bucket[0] -= cost
+        return 0
+      self.rejected += 1
+      return (needed - bucket[0]) / self.rate
+
+
+# process wide limiter for the token endpoints
+token_limiter = TokenBucketLimiter()
+registry.gauge('rate_limit_rejected', 'Requests refused by the per client token bucket',
+  lambda: token_limiter.rejected)
+
+
+def retry_after_seconds(wait: float) -> int:
+  return max(1, math.ceil(wait))
@@ -0,0 +1,42 @@
+'''
+  QueuePool that records checkout latency and saturation for /metrics
+'''
+import time, weakref
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from .metrics import registry
+
+# every live pool in the process, one per engine/bind
+_pools: 'weakref.WeakSet[InstrumentedQueuePool]' = weakref.WeakSet()
+
+checkout_seconds = registry.histogram('db_pool_checkout_seconds', 'Time spent waiting for a pooled connection')
+checkout_timeouts = registry.counter('db_pool_checkout_timeouts_total', 'Checkouts that gave up after pool_timeout')
+
+
+class InstrumentedQueuePool(QueuePool):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    _pools.add(self)
+
+  def _do_get(self):
+    started = time.perf_counter()
+    try:
+      return super()._do_get()
+    except PoolTimeoutError:
+      checkout_timeouts.inc()
+      raise
+    finally:
+      checkout_seconds.observe(time.perf_counter() - started)
+
+
+def _pool_stats(stat):
+  def collect():
+    return {(('pool', str(index)),): stat(pool) for index, pool in enumerate(list(_pools))}
+  return collect
+
+
+registry.gauge('db_pool_size', 'Configured pool size', _pool_stats(lambda pool: pool.size()))
+registry.gauge('db_pool_checked_out', 'Connections currently in use', _pool_stats(lambda pool: pool.checkedout()))
+registry.gauge('db_pool_overflow', 'Connections opened beyond pool_size', _pool_stats(lambda pool: pool.overflow()))
+registry.gauge('db_pool_saturation', 'Checked out connections over size plus max overflow',
+  _pool_stats(lambda pool: pool.checkedout() / max(1, pool.size() + pool._max_overflow)))
@@ -0,0 +1,180 @@
+'''
+  Read replica routing on top of flask-sqlalchemy binds
+  plain SELECTs go to a healthy replica, round robin, everything else stays on the primary.
+  A session that wrote is pinned to the primary, and so is the same client for REPLICA_MAX_LAG
+  seconds afterwards through a short lived cookie, so a user just created is never missing
+'''
+import time, logging, threading
+from typing import Dict, List
+from flask import Flask, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, text, orm
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# set after a write, requests carrying it read from the primary until it expires
+PRIMARY_COOKIE = '_db_primary'
+
+
+class ReplicaRouter:
+  def __init__(self):
+    self.engines: Dict[str, object] = {}
+    self.max_lag = 5.0
+    self.retry_after = 10.0
+    self._names: List[str] = []
+    self._healthy: Dict[str, bool] = {}
+    self._next = 0
+    self._stop = threading.Event()
+    self._thread: threading.Thread|None = None
+
+  @property
+  def enabled(self) -> bool:
+    return bool(self.engines)
+
+  def configure(self, engines: Dict[str, object], max_lag: float, retry_after: float):
+    self.engines = dict(engines)
+    self.max_lag = max_lag
+    self.retry_after = retry_after
+    self._names = sorted(engines)
+    self._healthy = dict.fromkeys(self._names, True)
+
+  def pick(self) -> str|None:
+    '''next healthy replica, None sends the read to the primary'''
+    names = self._names
+    for _ in range(len(names)):
+      # races only skew the rotation, no lock on the hot path
+      self._next = (self._next + 1) % len(names)
+      name = names[self._next]
+      if self._healthy.get(name):
+        return name
+    return None
+
+  def mark(self, name: str, healthy: bool):
+    if self._healthy.get(name) != healthy:
+      logger.warning('read replica %s is %s', name, 'healthy' if healthy else 'unhealthy')
+    self._healthy[name] = healthy
+
+  def check(self, name: str) -> bool:
+    '''replica answers and, on postgres, is not lagging more than max_lag seconds'''
+    try:
+      with self.engines[name].connect() as connection:
+        if connection.dialect.name == 'postgresql':
+          # replayed everything it received means caught up, the last replayed commit of an idle
+          # primary can be hours old. NULL when nothing was replayed yet
+          lag = connection.execute(text(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')).scalar()
+          return lag is None or lag <= self.max_lag
+        connection.execute(text('SELECT 1'))
+        return True
+    except Exception:
+      logger.warning('health check failed for read replica %s', name, exc_info=True)
+      return False
+
+  def check_all(self):
+    for name in self._names:
+      self.mark(name, self.check(name))
+
+  def _run(self):
+    while not self._stop.wait(self.retry_after):
+      self.check_all()
+
+  def start(self):
+    '''background health checks, once per process'''
+    if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, name='replica-health', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+
+
+# process wide router
+replica_router = ReplicaRouter()
+registry.gauge('db_replica_healthy', 'Read replica health, 1 healthy',
+  lambda: {(('bind', name),): int(healthy) for name, healthy in replica_router._healthy.items()})
+
+
+def _is_read(clause) -> bool:
+  # text() and anything else we can't inspect stays on the primary
+  return bool(getattr(clause, 'is_select', False)) and getattr(clause, '_for_update_arg', None) is None
+
+
+class RoutingSession(SignallingSession):
+  '''
+    info['primary'] pins the session to the primary, info['wrote'] records that it wrote
+  '''
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    if replica_router.enabled:
+      if clause is not None and _is_read(clause):
+        if not self._flushing and not self.info.get('primary'):
+          # one replica per session, reads within a request see one snapshot
+          name = self.info.get('replica') or replica_router.pick()
+          if name is not None:
+            self.info['replica'] = name
+            return replica_router.engines[name]
+      elif clause is not None or mapper is not None:
+        # writes, flushes and anything not known to be a read
+        self.info['primary'] = self.info['wrote'] = True
+    return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def pin_primary():
+  '''send the rest of this session's queries to the primary, for reads that decide a write'''
+  from . import db
+
+  db.session().info['primary'] = True
+
+
+def _pin_from_cookie():
+  if not replica_router.enabled:
+    return
+  try:
+    until = float(request.cookies.get(PRIMARY_COOKIE) or 0)
+  except ValueError:
+    return
+  if until > time.time():
+    pin_primary()
+
+
+def _set_primary_cookie(response):
+  from . import db
+
+  if replica_router.enabled and db.session.registry.has() and db.session().info.get('wrote'):
+    lag = replica_router.max_lag
+    # same attributes as the _session_mb cookie, it has to reach us on every cross site call the session does
+    response.set_cookie(PRIMARY_COOKIE, f'{time.time() + lag:.3f}', max_age=int(lag) + 1,
+      httponly=True, secure=True, samesite='None')
+  return response
+
+
+def _on_replica_error(context):
+  # a dropped replica connection takes the replica out until the next health check
+  if context.is_disconnect and context.engine is not None:
+    for name, engine in replica_router.engines.items():
+      if engine is context.engine:
+        replica_router.mark(name, False)
+
+
+def init_app(app: Flask, db: RoutingSQLAlchemy):
+  """Route reads to the binds listed in REPLICA_BINDS, no-op without replicas
+  config: REPLICA_BINDS, REPLICA_MAX_LAG, REPLICA_HEALTH_INTERVAL
+  """
+  names = app.config.get('REPLICA_BINDS') or []
+  if not names:
+    return
+  engines = {name: db.get_engine(app, bind=name) for name in names}
+  replica_router.configure(engines, app.config.get('REPLICA_MAX_LAG', 5), app.config.get('REPLICA_HEALTH_INTERVAL', 10))
+  for engine in engines.values():
+    event.listen(engine, 'handle_error', _on_replica_error)
+  app.before_request(_pin_from_cookie)
+  app.after_request(_set_primary_cookie)
+  replica_router.start()
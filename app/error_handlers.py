@@ -1,9 +1,12 @@
 """_summary_
 App wide flask error handlers
 """
-from flask import jsonify
+from flask import Response, current_app
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import ClassVar
+from .fast_json import dumps
+from .instrumentation import record_error
 
 # error classes
 @dataclass(frozen=True)
@@ -24,50 +27,55 @@ class RequestException(BaseAuthException):
 
 
 # handlers
+# error payloads have a fixed shape, each distinct body is encoded once and reused
+@lru_cache(maxsize=512)
+def known_error_body(code: int, error: str, message: str) -> bytes:
+  return dumps({'success': False, 'code': code, 'error': error, 'message': message}, sort_keys=True) + b'\n'
+
+@lru_cache(maxsize=512)
+def http_error_body(status: int, message: str) -> bytes:
+  return dumps({'success': False, 'message': message, 'error': status}, sort_keys=True) + b'\n'
+
+def error_response(body: bytes, status: int, headers: dict|None = None) -> Response:
+  return current_app.response_class(body, status=status, headers=headers, mimetype='application/json')
+
 def handle_known_error(exception: BaseAuthException):
-  return jsonify({
-    'success': False,
-    'code': exception.code,
-    'error': exception.error,
-    'message': exception.description
-  }), exception.code
+  record_error(exception)
+  return error_response(known_error_body(exception.code, exception.error, exception.description), exception.code)
 
 def handle_422(error):
   # bad syntax
-  return jsonify({
-    "success": False,
-    "message": error.description if error.description is not None else "Error in Query/Data",
-    "error": 422
-  }), 422
+  message = error.description if error.description is not None else "Error in Query/Data"
+  return error_response(http_error_body(422, message), 422)
 
 def handle_404(error):
   # Not Found
-  return jsonify({
-    "success": False,
-    "message": error.description if error.description is not None else "Resource not Found",
-    "error": 404
-  }), 404
+  message = error.description if error.description is not None else "Resource not Found"
+  return error_response(http_error_body(404, message), 404)
   
 def handle_400(error):
   # Not Found
-  return jsonify({
-    "success": False,
-    "message": error.description if error.description is not None else "Bad Syntax",
-    "error": 400
-  }), 400
+  message = error.description if error.description is not None else "Bad Syntax"
+  return error_response(http_error_body(400, message), 400)
 
 def handle_405(error):
   # Method Not Allowed
-  return jsonify({
-    "success": False,
-    "message": error.description if error.description is not None else "Method not allowed",
-    "error": 405
-  }), 405
+  message = error.description if error.description is not None else "Method not allowed"
+  return error_response(http_error_body(405, message), 405)
 
 def handle_503(error):
   # Server cannot process the request
-  return jsonify({
-    "success": False,
-    "message": error.description if error.description is not None else "System Busy",
-    "error": 503
-  }), 503
\ No newline at end of file
+  message = error.description if error.description is not None else "System Busy"
+  headers = {'Retry-After': str(error.retry_after)} if getattr(error, 'retry_after', None) else None
+  return error_response(http_error_body(503, message), 503, headers)
+
+def handle_429(error):
+  # Too Many Requests
+  message = error.description if error.description is not None else "Too many requests"
+  headers = {'Retry-After': str(error.retry_after)} if getattr(error, 'retry_after', None) else None
+  return error_response(http_error_body(429, message), 429, headers)
+
+
+# warm the bodies for the default payloads
+for _exception in (UnauthorizedException(), RequestException()):
+  known_error_body(_exception.code, _exception.error, _exception.description)
@@ -0,0 +1,66 @@
+'''
+  Pluggable json encoding, orjson when installed, stdlib json otherwise
+  installed as app.json_encoder so every jsonify goes through it
+'''
+import json
+from flask import Flask
+from flask.json import JSONEncoder
+from .instrumentation import phase
+
+try:
+  import orjson
+except ImportError:  # pragma: no cover - optional speedup
+  orjson = None
+
+BACKENDS = ('orjson', 'json')
+
+_backend = 'json'
+
+
+def use_backend(name: str) -> str:
+  """Pick the json backend, falls back to stdlib json if orjson is not installed
+  Args:
+    name (str): orjson or json
+  Returns:
+    str: the backend in use
+  """
+  global _backend
+  if name not in BACKENDS:
+    raise ValueError(f'Unknown JSON_BACKEND {name}, expected one of {BACKENDS}')
+  _backend = 'orjson' if name == 'orjson' and orjson is not None else 'json'
+  return _backend
+
+
+def _default(obj):
+  # flask's encoder handles dates, uuids, dataclasses and __html__
+  return JSONEncoder().default(obj)
+
+
+def dumps(obj, sort_keys: bool = False) -> bytes:
+  '''compact utf-8 json bytes'''
+  if _backend == 'orjson':
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if sort_keys:
+      option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=_default, option=option)
+  return json.dumps(obj, default=_default, sort_keys=sort_keys, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONEncoder(JSONEncoder):
+  '''flask 2.1 encoder hook, keeps flask's sort_keys/indent settings and times the json phase'''
+  def encode(self, o) -> str:
+    with phase('json'):
+      if _backend == 'orjson':
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+          option |= orjson.OPT_SORT_KEYS
+        if self.indent:
+          option |= orjson.OPT_INDENT_2
+        return orjson.dumps(o, default=self.default, option=option).decode('utf-8')
+      return super().encode(o)
+
+
+def init_app(app: Flask):
+  backend = use_backend(app.config.get('JSON_BACKEND', 'orjson'))
+  app.json_encoder = FastJSONEncoder
+  app.logger.info('Using %s for json encoding', backend)
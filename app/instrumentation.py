@@ -0,0 +1,101 @@
+'''
+  Per request timing, total time per endpoint plus time spent in each phase
+  (firebase, db, session cookie minting, json encoding), exported on /metrics
+'''
+import time
+from flask import Flask, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .metrics import registry
+
+PHASES = ('firebase', 'db', 'cookie', 'json')
+
+request_seconds = registry.histogram('http_request_duration_seconds', 'Request latency by endpoint')
+phase_seconds = registry.histogram('http_request_phase_seconds', 'Time spent in each phase of a request')
+auth_errors = registry.counter('auth_errors_total', 'Handled auth errors by type and status code')
+
+# endpoint -> (request series, {phase: series}), filled in once at startup
+_series = {}
+
+
+def _series_for(endpoint: str|None):
+  series = _series.get(endpoint)
+  if series is None:
+    series = _series[endpoint] = (
+      request_seconds.series(endpoint=str(endpoint)),
+      {name: phase_seconds.series(endpoint=str(endpoint), phase=name) for name in PHASES},
+    )
+  return series
+
+
+class phase:
+  '''
+    times a block into the current request's phase totals, a no-op outside requests
+    usage: with phase('firebase'): ...
+  '''
+  __slots__ = ('name', 'started')
+
+  def __init__(self, name: str):
+    self.name = name
+
+  def __enter__(self):
+    self.started = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    add_phase_time(self.name, time.perf_counter() - self.started)
+    return False
+
+
+def add_phase_time(name: str, seconds: float):
+  if not has_request_context():
+    return
+  phases = g.get('_phase_times')
+  if phases is None:
+    phases = g._phase_times = dict.fromkeys(PHASES, 0.0)
+  phases[name] = phases.get(name, 0.0) + seconds
+
+
+def record_error(exception):
+  auth_errors.inc(type=exception.__class__.__name__, code=exception.code)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  started = conn.info['_query_started'].pop()
+  add_phase_time('db', time.perf_counter() - started)
+
+
+def _before_request():
+  g._request_started = time.perf_counter()
+
+
+def _teardown_request(exc):
+  started = g.get('_request_started')
+  if started is None:
+    return
+  request_series, phase_series = _series_for(request.endpoint)
+  request_seconds.observe_series(request_series, time.perf_counter() - started)
+  phases = g.get('_phase_times')
+  if phases:
+    for name, seconds in phases.items():
+      if seconds and name in phase_series:
+        phase_seconds.observe_series(phase_series[name], seconds)
+
+
+def init_app(app: Flask):
+  # registered first so the timing covers the other before_request hooks
+  app.before_request_funcs.setdefault(None, []).insert(0, _before_request)
+  app.teardown_request(_teardown_request)
+
+
+def preallocate(app: Flask):
+  '''allocate every endpoint's series up front, call after blueprints are registered'''
+  for rule in app.url_map.iter_rules():
+    _series_for(rule.endpoint)
+  _series_for(None)
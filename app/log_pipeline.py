@@ -0,0 +1,183 @@
+'''
+  Non blocking logging, request threads only enqueue records
+  a listener thread drains the queue in batches and writes them to cloud logging or the file sink
+'''
+import os, time, queue, atexit, logging
+from logging.handlers import QueueHandler, QueueListener
+from os import environ as env
+from typing import List
+from .metrics import registry
+
+# loggers the cloud logging transport itself writes to, they must not feed back into it
+EXCLUDED_LOGGERS = ('google.cloud', 'google.auth', 'google_auth_httplib2', 'google.api_core.bidi', 'werkzeug')
+
+dropped_records = registry.counter('log_records_dropped_total', 'Log records dropped because the queue was full')
+
+_listener: 'BatchingQueueListener|None' = None
+
+
+class DroppingQueueHandler(QueueHandler):
+  '''never blocks the caller, counts records dropped when the queue is full'''
+  def enqueue(self, record: logging.LogRecord):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      dropped_records.inc()
+
+
+class BatchingQueueListener(QueueListener):
+  '''hands records to the handlers in batches of up to batch_size'''
+  def __init__(self, log_queue: queue.Queue, *handlers: logging.Handler, batch_size: int = 256):
+    super().__init__(log_queue, *handlers, respect_handler_level=True)
+    self.batch_size = batch_size
+
+  def handle_batch(self, records: List[logging.LogRecord]):
+    for handler in self.handlers:
+      emit_batch = getattr(handler, 'emit_batch', None)
+      if emit_batch is not None:
+        emit_batch(records)
+        continue
+      for record in records:
+        if record.levelno >= handler.level:
+          handler.handle(record)
+
+  def _monitor(self):
+    log_queue = self.queue
+    stopping = False
+    while not stopping:
+      record = log_queue.get()
+      if record is self._sentinel:
+        break
+      batch = [record]
+      while len(batch) < self.batch_size:
+        try:
+          record = log_queue.get_nowait()
+        except queue.Empty:
+          break
+        if record is self._sentinel:
+          stopping = True
+          break
+        batch.append(record)
+      self.handle_batch(batch)
+
+
+class _BatchWriteMixin:
+  '''write a whole batch with one write and one flush'''
+  def emit_batch(self, records: List[logging.LogRecord]):
+    records = [record for record in records if record.levelno >= self.level and self.filter(record)]
+    if not records:
+      return
+    try:
+      text = ''.join(self.format(record) + self.terminator for record in records)
+      self.acquire()
+      try:
+        if self.stream is None:
+          self.stream = self._open()
+        self.stream.write(text)
+        self.flush()
+      finally:
+        self.release()
+    except Exception:
+      self.handleError(records[-1])
+
+
+class BatchFileHandler(_BatchWriteMixin, logging.FileHandler):
+  pass
+
+
+class BatchStreamHandler(_BatchWriteMixin, logging.StreamHandler):
+  pass
+
+
+class LazyCloudLoggingHandler(logging.Handler):
+  '''
+    builds the cloud logging client on the first record, on the listener thread
+    while the client can't be built, e.g no credentials yet, records go to stderr and
+    the client is retried every retry_interval seconds
+  '''
+  def __init__(self, level=logging.NOTSET, retry_interval: float = 60):
+    super().__init__(level)
+    self.retry_interval = retry_interval
+    self._handler = None
+    self._fallback = logging.StreamHandler()
+    self._retry_at = 0.0
+
+  def _build_handler(self, record: logging.LogRecord) -> logging.Handler|None:
+    if time.monotonic() < self._retry_at:
+      return None
+    try:
+      import google.cloud.logging
+      from google.cloud.logging.handlers import CloudLoggingHandler
+
+      return CloudLoggingHandler(google.cloud.logging.Client())
+    except Exception:
+      # an exception escaping emit would end the listener thread and all logging with it
+      self._retry_at = time.monotonic() + self.retry_interval
+      self.handleError(record)
+      return None
+
+  def emit(self, record):
+    if self._handler is None:
+      self._handler = self._build_handler(record)
+    (self._handler or self._fallback).handle(record)
+
+
+def _sink_handlers(app_env: str) -> List[logging.Handler]:
+  if app_env.startswith('standard'):
+    # gcloud production environment, use google cloud logging
+    # its own transport already batches the api calls
+    stderr_handler = logging.StreamHandler()
+    for name in EXCLUDED_LOGGERS:
+      logger = logging.getLogger(name)
+      logger.propagate = False
+      logger.addHandler(stderr_handler)
+    return [LazyCloudLoggingHandler(logging.INFO)]
+
+  # dev env, log to file
+  root = os.path.dirname(os.path.abspath(__file__))
+  logdir = os.path.join(root, env.get('LOG_DIR', 'logs'))
+  if not os.path.exists(logdir):
+    os.mkdir(logdir)
+  log_file = os.path.join(logdir, env.get('LOG_FILE', 'app.log'))
+
+  # configure formatters
+  detailed_format = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s - %(funcName)s - %(message)s')
+  simple_format = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(message)s')
+
+  # configure handlers
+  file_handler = BatchFileHandler(log_file)
+  file_handler.setLevel(logging.INFO)
+  file_handler.setFormatter(detailed_format)
+  stream_handler = BatchStreamHandler()
+  stream_handler.setLevel(logging.INFO)
+  stream_handler.setFormatter(simple_format)
+  return [file_handler, stream_handler]
+
+
+def setup_logging(app_env: str = ''):
+  """Route the root logger through a bounded queue drained by a listener thread
+  LOG_QUEUE_SIZE bounds memory, records beyond it are dropped and counted
+  Args:
+    app_env (str): GAE_ENV, standard* logs to cloud logging, anything else to file and stderr
+  """
+  global _listener
+  if _listener is not None:
+    # already set up in this process
+    return
+  log_queue: queue.Queue = queue.Queue(maxsize=int(env.get('LOG_QUEUE_SIZE', 10000)))
+  _listener = BatchingQueueListener(log_queue, *_sink_handlers(app_env),
+                                    batch_size=int(env.get('LOG_BATCH_SIZE', 256)))
+  registry.gauge('log_queue_depth', 'Log records waiting to be written', log_queue.qsize)
+
+  logger = logging.getLogger()
+  logger.setLevel(logging.INFO)
+  logger.addHandler(DroppingQueueHandler(log_queue))
+  _listener.start()
+  # flush what is queued on shutdown
+  atexit.register(stop_logging)
+
+
+def stop_logging():
+  '''flush queued records and stop the listener thread'''
+  if _listener is not None and _listener._thread is not None:
+    _listener.stop()
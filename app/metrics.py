@@ -0,0 +1,154 @@
+'''
+  Minimal in-process metrics, rendered in prometheus text format on /metrics
+  buckets are allocated when a metric is created so observing never allocates
+'''
+import time, threading
+from bisect import bisect_left
+from os import environ as env
+from typing import Callable, Dict, List, Tuple
+
+# seconds, covers a dict lookup up to a slow network call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_text(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+  parts = [f'{key}="{value}"' for key, value in labels]
+  if extra:
+    parts.append(extra)
+  return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+  def __init__(self, name: str, description: str):
+    self.name = name
+    self.description = description
+    self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+    self._lock = threading.Lock()
+
+  def inc(self, amount: float = 1, **labels):
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def value(self, **labels) -> float:
+    return self._values.get(tuple(sorted(labels.items())), 0)
+
+  def render(self) -> List[str]:
+    lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+    for labels, value in list(self._values.items()):
+      lines.append(f'{self.name}{_labels_text(labels)} {value}')
+    return lines
+
+
+class Gauge:
+  '''value is read from a callback at render time, returning {labels tuple: value} or a number'''
+  def __init__(self, name: str, description: str, callback: Callable):
+    self.name = name
+    self.description = description
+    self.callback = callback
+
+  def render(self) -> List[str]:
+    lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge']
+    values = self.callback()
+    if not isinstance(values, dict):
+      values = {(): values}
+    for labels, value in values.items():
+      lines.append(f'{self.name}{_labels_text(labels)} {value}')
+    return lines
+
+
+class _HistogramSeries:
+  __slots__ = ('counts', 'sum', 'count')
+
+  def __init__(self, size: int):
+    # one slot per bucket plus +Inf
+    self.counts = [0] * (size + 1)
+    self.sum = 0.0
+    self.count = 0
+
+
+class Histogram:
+  def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+    self.name = name
+    self.description = description
+    self.buckets = tuple(sorted(buckets))
+    self._series: Dict[Tuple[Tuple[str, str], ...], _HistogramSeries] = {}
+    self._lock = threading.Lock()
+
+  def series(self, **labels) -> _HistogramSeries:
+    '''get or preallocate the series for a label set'''
+    key = tuple(sorted(labels.items()))
+    series = self._series.get(key)
+    if series is None:
+      with self._lock:
+        series = self._series.setdefault(key, _HistogramSeries(len(self.buckets)))
+    return series
+
+  def observe(self, value: float, **labels):
+    self.observe_series(self.series(**labels), value)
+
+  def observe_series(self, series: _HistogramSeries, value: float):
+    index = bisect_left(self.buckets, value)
+    with self._lock:
+      series.counts[index] += 1
+      series.sum += value
+      series.count += 1
+
+  def render(self) -> List[str]:
+    lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+    for labels, series in list(self._series.items()):
+      cumulative = 0
+      for bound, count in zip(self.buckets, series.counts):
+        cumulative += count
+        le = 'le="%s"' % bound
+        lines.append(f'{self.name}_bucket{_labels_text(labels, le)} {cumulative}')
+      le = 'le="+Inf"'
+      lines.append(f'{self.name}_bucket{_labels_text(labels, le)} {series.count}')
+      lines.append(f'{self.name}_sum{_labels_text(labels)} {series.sum}')
+      lines.append(f'{self.name}_count{_labels_text(labels)} {series.count}')
+    return lines
+
+
+class Registry:
+  def __init__(self):
+    self._metrics: Dict[str, Counter|Gauge|Histogram] = {}
+
+  def register(self, metric):
+    # modules can be imported more than once in a process, keep the first instance
+    return self._metrics.setdefault(metric.name, metric)
+
+  def counter(self, name: str, description: str) -> Counter:
+    return self.register(Counter(name, description))
+
+  def gauge(self, name: str, description: str, callback: Callable) -> Gauge:
+    return self.register(Gauge(name, description, callback))
+
+  def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return self.register(Histogram(name, description, buckets))
+
+  def render(self) -> str:
+    lines = []
+    for metric in list(self._metrics.values()):
+      lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# process wide registry
+registry = Registry()
+
+_started = time.time()
+registry.gauge('process_start_time_seconds', 'Unix time the process started', lambda: _started)
+
+
+def metrics_view():
+  from flask import request, abort
+
+  # optional shared secret, /metrics is otherwise public on app engine
+  token = env.get('METRICS_TOKEN')
+  if token and request.headers.get('Authorization') != f'Bearer {token}':
+    abort(404)
+  return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def init_app(app):
+  app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
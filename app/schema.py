@@ -0,0 +1,103 @@
+'''
+  Schema check and upgrade against the migrations shipped in /migrations
+  startup only compares alembic_version with the script heads, alembic and the
+  upgrade run only when the db is behind, under a postgres advisory lock
+'''
+import os, time, logging
+from typing import Set
+from flask import Flask
+from . import MIGRATIONS_DIR
+
+logger = logging.getLogger(__name__)
+
+# arbitrary, shared by every instance of the app
+MIGRATION_LOCK_ID = 0x6d6261757468
+
+
+def _script_directory(directory: str):
+  from alembic.config import Config
+  from alembic.script import ScriptDirectory
+  
+  config = Config(os.path.join(directory, 'alembic.ini'))
+  config.set_main_option('script_location', directory)
+  return ScriptDirectory.from_config(config)
+
+
+def head_revisions(directory: str = MIGRATIONS_DIR) -> Set[str]:
+  '''revisions the shipped scripts end at, reads files only'''
+  return set(_script_directory(directory).get_heads())
+
+
+def unknown_revisions(revisions: Set[str], directory: str = MIGRATIONS_DIR) -> Set[str]:
+  '''revisions recorded in the db that the shipped scripts do not have'''
+  script = _script_directory(directory)
+  unknown = set()
+  for revision in revisions:
+    try:
+      script.get_revision(revision)
+    except Exception:
+      unknown.add(revision)
+  return unknown
+
+
+def current_revisions(connection) -> Set[str]:
+  '''revisions recorded in alembic_version, empty when the table does not exist'''
+  from alembic.runtime.migration import MigrationContext
+  
+  return set(MigrationContext.configure(connection).get_current_heads())
+
+
+def _acquire_lock(connection, timeout: float) -> bool:
+  '''poll for the advisory lock so a stuck upgrade cannot block startup forever'''
+  from sqlalchemy import text
+  
+  deadline = time.monotonic() + timeout
+  while True:
+    if connection.execute(text('SELECT pg_try_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID}).scalar():
+      return True
+    if time.monotonic() >= deadline:
+      return False
+    time.sleep(0.5)
+
+
+def ensure_schema(app: Flask, directory: str = MIGRATIONS_DIR, lock_timeout: float = 60) -> bool:
+  """Upgrade the db to the shipped head if it is behind
+  Args:
+    app (Flask): app whose db is checked
+    directory (str): migrations directory
+    lock_timeout (float): seconds to wait for another instance's upgrade
+  Returns:
+    bool: True if this call ran an upgrade
+  """
+  from flask_migrate import upgrade
+  from sqlalchemy import text
+  from . import db
+  
+  heads = head_revisions(directory)
+  with app.app_context():
+    engine = db.get_engine()
+    with engine.connect() as connection:
+      current = current_revisions(connection)
+      if current == heads:
+        return False
+      unknown = unknown_revisions(current, directory)
+      if unknown:
+        # e.g tables made by the old generated /tmp/migrations, needs `flask db stamp`
+        logger.error('Database revision %s is not in %s, skipping upgrade', sorted(unknown), directory)
+        return False
+      if connection.dialect.name != 'postgresql':
+        upgrade(directory=directory)
+        return True
+      if not _acquire_lock(connection, lock_timeout):
+        logger.error('Timed out waiting for the migration lock, skipping upgrade')
+        return False
+      try:
+        # another instance may have upgraded while we waited
+        if current_revisions(connection) == heads:
+          return False
+        logger.info('Upgrading database from %s to %s', sorted(current), sorted(heads))
+        upgrade(directory=directory)
+        return True
+      finally:
+        connection.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+
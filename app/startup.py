@@ -0,0 +1,132 @@
+'''
+  Startup timing and deferred initialization of the heavy clients
+  firebase and its signing keys are set up on the first request or on app engine's
+  /_ah/warmup, whichever comes first, instead of inside create_app
+'''
+import time, logging, threading, importlib
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from flask import Flask, jsonify, current_app
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# modules only imported inside request handlers, loaded ahead of traffic on warmup
+WARMUP_IMPORTS = (
+  'sqlalchemy.dialects.postgresql',
+  'requests',
+)
+
+
+class StartupReport:
+  '''wall time of each startup phase, in the order they ran'''
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.phases: List[Tuple[str, float]] = []
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def phase(self, name: str):
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      with self._lock:
+        self.phases.append((name, time.perf_counter() - started))
+
+  def as_dict(self) -> Dict[str, float]:
+    report = {name: round(seconds, 4) for name, seconds in self.phases}
+    report['total'] = round(sum(seconds for _, seconds in self.phases), 4)
+    return report
+
+
+startup_report = StartupReport()
+registry.gauge('startup_phase_seconds', 'Time spent in each startup phase',
+  lambda: {(('phase', name),): seconds for name, seconds in startup_report.phases})
+
+_firebase_app = None
+_firebase_lock = threading.Lock()
+
+
+def ensure_firebase(app: Flask|None = None, prefetch_keys: bool = False):
+  """Initialize firebase and the signing key store once per process
+  Args:
+    app (Flask|None): app to read config from, current_app if None
+    prefetch_keys (bool): fetch signing keys now instead of in the background
+  Returns:
+    firebase app
+  """
+  global _firebase_app
+  if _firebase_app is not None:
+    return _firebase_app
+  from . import setup_firebase
+  from .auth.keystore import setup_keystore
+  from .auth.cookie_signer import setup_cookie_signer
+
+  app = app or current_app._get_current_object()
+  with _firebase_lock:
+    if _firebase_app is None:
+      with startup_report.phase('firebase'):
+        fb_app = setup_firebase(app.config.get('FIREBASE_HTTP_TIMEOUT'))
+      with startup_report.phase('keystore'):
+        setup_keystore(fb_app, key_file=app.config.get('KEYSTORE_FILE'),
+          background_refresh=app.config.get('KEYSTORE_BACKGROUND_REFRESH', True),
+          fetch_timeout=app.config.get('KEYSTORE_FETCH_TIMEOUT', 5),
+          prefetch=prefetch_keys,
+          refetch_interval=app.config.get('KEYSTORE_REFETCH_INTERVAL', 10))
+      with startup_report.phase('cookie_signer'):
+        setup_cookie_signer(fb_app, fetch_certs=not app.config.get('KEYSTORE_FILE'),
+          local_signing=app.config.get('SESSION_COOKIE_LOCAL_SIGNING', True))
+      _firebase_app = fb_app
+  return _firebase_app
+
+
+def firebase_ready() -> bool:
+  return _firebase_app is not None
+
+
+def _before_request():
+  # a single global check once initialized
+  if _firebase_app is None:
+    ensure_firebase()
+
+
+def warmup():
+  '''app engine warmup request, primes everything the first user request would pay for'''
+  from . import db
+  from sqlalchemy import text
+  from .auth.keystore import key_store
+  from .auth.permissions import permission_engine
+
+  app = current_app._get_current_object()
+  with startup_report.phase('warmup_firebase'):
+    ensure_firebase(app, prefetch_keys=True)
+    key_store.refresh()
+  with startup_report.phase('warmup_db'):
+    # open a few pooled connections so the first requests skip the handshake
+    connections = []
+    try:
+      for _ in range(app.config.get('WARMUP_DB_CONNECTIONS', 2)):
+        connection = db.engine.connect()
+        connections.append(connection)
+        connection.execute(text('SELECT 1'))
+    except Exception:
+      logger.warning('Failed to prime db pool on warmup', exc_info=True)
+    finally:
+      for connection in connections:
+        connection.close()
+  with startup_report.phase('warmup_permissions'):
+    permission_engine.load()
+  with startup_report.phase('warmup_imports'):
+    for module in WARMUP_IMPORTS:
+      importlib.import_module(module)
+  logger.info('warmup done %s', startup_report.as_dict())
+  return jsonify(startup_report.as_dict()), 200
+
+
+def init_app(app: Flask):
+  app.add_url_rule('/_ah/warmup', 'warmup', warmup, methods=['GET'])
+  if app.config.get('LAZY_INIT', True):
+    app.before_request(_before_request)
+  else:
+    ensure_firebase(app, prefetch_keys=True)
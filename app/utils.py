@@ -1,3 +1,4 @@
+import json, time
 import click
 from flask.cli import AppGroup
 from app import db
@@ -15,8 +16,69 @@ def db_tables(action='create'):
     db.drop_all()
     
 
-@app_cli.command('dbrows')
-@click.argument('action')
-def db_rows(action='create'):
-  # run action
-  pass
+@app_cli.command('import-users')
+@click.argument('source', type=click.File('r'), required=False)
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson', show_default=True)
+@click.option('--from-firebase', is_flag=True, help='page through every firebase user instead of reading a file')
+@click.option('--chunk-size', default=1000, show_default=True, help='users inserted per statement and commit')
+def import_users(source, fmt: str, from_firebase: bool, chunk_size: int):
+  '''bulk load users and user_role from an ndjson/csv file (- for stdin) or firebase'''
+  from .auth.bulk import UserImporter, iter_file_records, iter_firebase_records
+  
+  if from_firebase:
+    from .startup import ensure_firebase
+    
+    ensure_firebase()
+    records = iter_firebase_records()
+  elif source is not None:
+    records = iter_file_records(source, fmt)
+  else:
+    raise click.UsageError('pass a SOURCE file or --from-firebase')
+  progress = lambda report: click.echo(f'import progress {json.dumps(report.to_dict())}', err=True)
+  report = UserImporter(chunk_size, progress).run(records)
+  click.echo(json.dumps(report.to_dict()))
+
+
+@app_cli.command('export-users')
+@click.argument('target', type=click.File('w'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson', show_default=True)
+@click.option('--chunk-size', default=1000, show_default=True, help='users read from the db per page')
+def export_users(target, fmt: str, chunk_size: int):
+  '''stream every user with their roles to TARGET (default stdout)'''
+  from .auth.bulk import iter_export_records, write_records
+  
+  started = time.perf_counter()
+  written = write_records(iter_export_records(chunk_size), target, fmt)
+  elapsed = time.perf_counter() - started
+  click.echo(json.dumps({'written': written, 'elapsed': round(elapsed, 3)}), err=True)
+
+
+@app_cli.command('sync-claims')
+@click.option('--workers', default=8, show_default=True, help='concurrent firebase updates')
+@click.option('--chunk-size', default=500, show_default=True, help='users read from the db per page')
+@click.option('--retries', default=5, show_default=True, help='retries per user on transient errors')
+@click.option('--dry-run', is_flag=True, help='only report how many users would change')
+def sync_claims(workers: int, chunk_size: int, retries: int, dry_run: bool):
+  '''push the Roles custom claim for every user whose firebase claims differ from user_role'''
+  from .auth.claims import ClaimsSync, iter_db_roles
+  from .startup import ensure_firebase
+  
+  ensure_firebase()
+  sync = ClaimsSync(workers=workers, max_retries=retries, dry_run=dry_run)
+  report = sync.run(iter_db_roles(chunk_size))
+  click.echo(json.dumps(report.to_dict()))
+  for user_id, error in report.failures:
+    click.echo(f'failed {user_id}: {error}', err=True)
+
+
+@app_cli.command('sync-revocations')
+def sync_revocations():
+  '''copy session revocations made in the firebase console or by password resets into token_revocations'''
+  from .auth.revocation import sync_revocations as sync
+  from .startup import ensure_firebase
+  
+  ensure_firebase()
+  started = time.perf_counter()
+  report = sync()
+  report['elapsed'] = round(time.perf_counter() - started, 3)
+  click.echo(json.dumps(report))
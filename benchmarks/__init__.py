@@ -0,0 +1,3 @@
+'''
+  Load and latency benchmarks for the auth endpoints, see auth_bench.py
+'''
@@ -0,0 +1,39 @@
+'''
+  flask config for benchmark runs, auth_bench.py sets the env before create_app loads it
+'''
+import os
+from os import environ as env
+from configs import engine_options, env_bool
+
+DEBUG = False
+
+# BENCH_DB_URI is a local postgres or sqlite file
+SQLALCHEMY_DATABASE_URI = env.get('BENCH_DB_URI')
+SQLALCHEMY_ECHO = False
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+DATABASE_CONNECT_OPTIONS = {}
+
+# the same settings the app ships with, see configs/common.py
+from configs.common import *
+
+# sized like production
+SESSION_CACHE_MAX_SIZE = int(env.get('SESSION_CACHE_MAX_SIZE', 4096))
+
+# every request comes from one address, don't throttle or shed the load generator
+RATE_LIMIT_PER_SECOND = float(env.get('RATE_LIMIT_PER_SECOND', 0))
+ADMISSION_MAX_IN_FLIGHT = int(env.get('ADMISSION_MAX_IN_FLIGHT', 0))
+
+# keys come from the fake signer in KEYSTORE_FILE, never from google
+KEYSTORE_BACKGROUND_REFRESH = False
+
+# measure requests, not startup
+LAZY_INIT = env_bool('LAZY_INIT', False)
+WARMUP_DB_CONNECTIONS = int(env.get('WARMUP_DB_CONNECTIONS', 0))
+
+THREADS_PER_PAGE = int(env.get('BENCH_CONCURRENCY', 8))
+
+SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, THREADS_PER_PAGE, DATABASE_CONNECT_OPTIONS,
+  max_overflow=0, pool_timeout=30)
+
+SECRET_KEY = os.urandom(32)
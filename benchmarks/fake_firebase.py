@@ -0,0 +1,87 @@
+'''
+  Local stand in for the firebase signer
+  mints ID tokens and session cookies that firebase_admin verifies against the keys written
+  to a KEYSTORE_FILE, and a matching service account for GCLOUD_APP_CRED
+'''
+import json, time, datetime
+from typing import Any, Dict, List
+import jwt
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ID_TOKEN_ISSUER = 'https://securetoken.google.com/'
+SESSION_COOKIE_ISSUER = 'https://session.firebase.google.com/'
+
+
+class FakeFirebaseSigner:
+  def __init__(self, project_id: str = 'bench-project', kid: str = 'bench-key'):
+    self.project_id = project_id
+    self.kid = kid
+    self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    self.private_pem = self.private_key.private_bytes(
+      serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, project_id)])
+    now = datetime.datetime.utcnow()
+    self.certificate = x509.CertificateBuilder()\
+      .subject_name(name).issuer_name(name)\
+      .public_key(self.private_key.public_key())\
+      .serial_number(x509.random_serial_number())\
+      .not_valid_before(now - datetime.timedelta(days=1))\
+      .not_valid_after(now + datetime.timedelta(days=30))\
+      .sign(self.private_key, hashes.SHA256())
+    self.cert_pem = self.certificate.public_bytes(serialization.Encoding.PEM).decode('utf-8')
+
+  def key_sets(self) -> Dict[str, Dict[str, str]]:
+    '''KEYSTORE_FILE contents'''
+    return {'id_token': {self.kid: self.cert_pem}, 'session_cookie': {self.kid: self.cert_pem}}
+
+  def write_key_file(self, path: str):
+    with open(path, 'w') as key_file:
+      json.dump(self.key_sets(), key_file)
+
+  def service_account(self) -> Dict[str, str]:
+    '''GCLOUD_APP_CRED contents, gives firebase_admin a project id without touching google'''
+    return {
+      'type': 'service_account',
+      'project_id': self.project_id,
+      'private_key_id': self.kid,
+      'private_key': self.private_pem.decode('utf-8'),
+      'client_email': f'bench@{self.project_id}.iam.gserviceaccount.com',
+      'client_id': '0',
+      'token_uri': 'https://oauth2.googleapis.com/token',
+    }
+
+  def _sign(self, claims: Dict[str, Any]) -> str:
+    return jwt.encode(claims, self.private_pem, algorithm='RS256', headers={'kid': self.kid})
+
+  def id_token(self, uid: str, roles: List[str]|None = None, email_verified: bool = True,
+               lifetime: int = 3600) -> str:
+    now = int(time.time())
+    return self._sign({
+      'iss': ID_TOKEN_ISSUER + self.project_id,
+      'aud': self.project_id,
+      'sub': uid,
+      'user_id': uid,
+      'auth_time': now,
+      'iat': now,
+      'exp': now + lifetime,
+      'email': f'{uid}@bench.local',
+      'email_verified': email_verified,
+      'firebase': {'identities': {}, 'sign_in_provider': 'password'},
+      'Roles': roles or [],
+    })
+
+  def create_session_cookie(self, id_token: str, expires_in: datetime.timedelta|int, app=None) -> str:
+    '''same signature as firebase_admin.auth.create_session_cookie'''
+    if isinstance(expires_in, datetime.timedelta):
+      expires_in = int(expires_in.total_seconds())
+    claims = jwt.decode(id_token, options={'verify_signature': False})
+    now = int(time.time())
+    claims.update({
+      'iss': SESSION_COOKIE_ISSUER + self.project_id,
+      'iat': now,
+      'exp': now + expires_in,
+    })
+    return self._sign(claims)
@@ -0,0 +1,64 @@
+'''
+  helpers shared by the environment configs
+'''
+from os import environ as env
+
+# gthread threads per gunicorn worker, gunicorn.conf.py and THREADS_PER_PAGE both start from it
+DEFAULT_THREADS = 8
+
+
+def threads_per_worker() -> int:
+  '''request threads per worker process, GUNICORN_THREADS overrides the default'''
+  return int(env.get('GUNICORN_THREADS', DEFAULT_THREADS))
+
+
+def env_bool(name: str, default: bool) -> bool:
+  value = env.get(name)
+  if value is None:
+    return default
+  return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(database_uri: str|None, threads: int, connect_options: dict|None = None,
+                   max_overflow: int = 2, pool_timeout: int = 10, pool_recycle: int = 1800,
+                   statement_timeout: int = 0) -> dict:
+  """Build SQLALCHEMY_ENGINE_OPTIONS, every value can be overridden from env
+  each gunicorn worker has its own pool, so the pool holds one connection per worker thread
+  Args:
+    database_uri (str|None): SQLALCHEMY_DATABASE_URI
+    threads (int): request threads per worker process
+    connect_options (dict|None): extra DBAPI connect arguments, DATABASE_CONNECT_OPTIONS
+    max_overflow (int): connections allowed beyond the pool size
+    pool_timeout (int): seconds to wait for a connection before failing
+    pool_recycle (int): seconds before a connection is replaced, survives cloud sql maintenance
+    statement_timeout (int): postgres statement_timeout in ms, 0 disables it
+  Returns:
+    dict: engine options
+  """
+  options = {'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True)}
+  if not database_uri or database_uri.startswith('sqlite'):
+    # sqlite uses its own pool classes which take no sizing
+    return options
+  options.update({
+    'pool_size': int(env.get('DB_POOL_SIZE', threads)),
+    'max_overflow': int(env.get('DB_MAX_OVERFLOW', max_overflow)),
+    'pool_timeout': int(env.get('DB_POOL_TIMEOUT', pool_timeout)),
+    'pool_recycle': int(env.get('DB_POOL_RECYCLE', pool_recycle)),
+  })
+  connect_args = dict(connect_options or {})
+  statement_timeout = int(env.get('DB_STATEMENT_TIMEOUT', statement_timeout))
+  if statement_timeout and database_uri.startswith('postgres'):
+    connect_args['options'] = f"{connect_args.get('options', '')} -c statement_timeout={statement_timeout}".strip()
+  if connect_args:
+    options['connect_args'] = connect_args
+  return options
+
+
+def replica_binds(uris: str|None) -> dict:
+  """SQLALCHEMY_BINDS for read replicas
+  Args:
+    uris (str|None): comma separated replica database uris
+  Returns:
+    dict: replica_0, replica_1... to uri
+  """
+  return {f'replica_{index}': uri.strip() for index, uri in enumerate((uris or '').split(',')) if uri.strip()}
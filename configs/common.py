@@ -0,0 +1,89 @@
+'''
+  performance settings shared by the environment configs, each config star imports
+  this module and only restates what differs for its environment
+'''
+from os import environ as env
+from configs import env_bool, replica_binds, threads_per_worker
+
+# read replicas, comma separated uris in DB_REPLICA_URIS, plain reads are routed to them
+# and clients read from the primary for REPLICA_MAX_LAG seconds after a write, see app/db_routing.py
+SQLALCHEMY_BINDS = replica_binds(env.get('DB_REPLICA_URIS'))
+REPLICA_BINDS = list(SQLALCHEMY_BINDS)
+REPLICA_MAX_LAG = float(env.get('REPLICA_MAX_LAG', 5))
+REPLICA_HEALTH_INTERVAL = float(env.get('REPLICA_HEALTH_INTERVAL', 10))
+
+# verified session cookie cache, entries never outlive the cookie exp
+SESSION_CACHE_MAX_SIZE = int(env.get('SESSION_CACHE_MAX_SIZE', 1024))
+SESSION_CACHE_TTL = int(env.get('SESSION_CACHE_TTL', 300))
+
+# browsers may reuse a verify_session answer this long, never past the cookie exp
+VERIFY_SESSION_MAX_AGE = int(env.get('VERIFY_SESSION_MAX_AGE', 60))
+
+# rejected id tokens are refused without crypto for NEGATIVE_CACHE_TTL seconds
+NEGATIVE_CACHE_MAX_SIZE = int(env.get('NEGATIVE_CACHE_MAX_SIZE', 4096))
+NEGATIVE_CACHE_TTL = int(env.get('NEGATIVE_CACHE_TTL', 300))
+
+# token bucket per client ip on the token endpoints, 0 disables it
+RATE_LIMIT_PER_SECOND = float(env.get('RATE_LIMIT_PER_SECOND', 5))
+RATE_LIMIT_BURST = int(env.get('RATE_LIMIT_BURST', 20))
+RATE_LIMIT_MAX_CLIENTS = int(env.get('RATE_LIMIT_MAX_CLIENTS', 10000))
+
+# POST /api/auth/verify_tokens, workers defaults to the cpu count
+BATCH_VERIFY_MAX_TOKENS = int(env.get('BATCH_VERIFY_MAX_TOKENS', 100))
+BATCH_VERIFY_WORKERS = int(env.get('BATCH_VERIFY_WORKERS', 0)) or None
+BATCH_VERIFY_INLINE_BELOW = int(env.get('BATCH_VERIFY_INLINE_BELOW', 4))
+BATCH_VERIFY_TIMEOUT = float(env.get('BATCH_VERIFY_TIMEOUT', 10))
+
+# local revocation index, refreshed from token_revocations every REVOCATION_REFRESH_INTERVAL seconds
+REVOCATION_REFRESH_INTERVAL = int(env.get('REVOCATION_REFRESH_INTERVAL', 30))
+REVOCATION_OVERLAP = int(env.get('REVOCATION_OVERLAP', 300))
+# longest possible session cookie lifetime, firebase caps it at 14 days
+REVOCATION_MAX_AGE = int(env.get('REVOCATION_MAX_AGE', 14 * 24 * 3600))
+
+# firebase signing keys, KEYSTORE_FILE loads them from disk instead of google
+KEYSTORE_FILE = env.get('KEYSTORE_FILE', None)
+KEYSTORE_BACKGROUND_REFRESH = True
+KEYSTORE_FETCH_TIMEOUT = float(env.get('KEYSTORE_FETCH_TIMEOUT', 5))
+# at most one refetch per key set this often for tokens signed with a kid we don't have
+KEYSTORE_REFETCH_INTERVAL = float(env.get('KEYSTORE_REFETCH_INTERVAL', 10))
+
+# seconds before a firebase admin api call gives up
+FIREBASE_HTTP_TIMEOUT = float(env.get('FIREBASE_HTTP_TIMEOUT', 10))
+# firebase calls fail fast with a 503 for BREAKER_OPEN_SECONDS once BREAKER_FAILURE_RATE of the
+# calls in the last BREAKER_WINDOW seconds failed, at least BREAKER_MIN_CALLS of them
+BREAKER_FAILURE_RATE = float(env.get('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_MIN_CALLS = int(env.get('BREAKER_MIN_CALLS', 10))
+BREAKER_WINDOW = float(env.get('BREAKER_WINDOW', 30))
+BREAKER_OPEN_SECONDS = float(env.get('BREAKER_OPEN_SECONDS', 15))
+BREAKER_HALF_OPEN_PROBES = int(env.get('BREAKER_HALF_OPEN_PROBES', 2))
+
+# mint session cookies with the service account key instead of calling firebase
+SESSION_COOKIE_LOCAL_SIGNING = env_bool('SESSION_COOKIE_LOCAL_SIGNING', True)
+
+# defer firebase setup to /_ah/warmup or the first request
+LAZY_INIT = env_bool('LAZY_INIT', True)
+WARMUP_DB_CONNECTIONS = int(env.get('WARMUP_DB_CONNECTIONS', 2))
+
+# check the db against the shipped migrations on startup and upgrade when behind
+MIGRATE_ON_STARTUP = env_bool('MIGRATE_ON_STARTUP', False)
+MIGRATIONS_DIR = env.get('MIGRATIONS_DIR', None)
+# seconds to wait for an upgrade another instance is running
+MIGRATE_LOCK_TIMEOUT = float(env.get('MIGRATE_LOCK_TIMEOUT', 60))
+
+# seconds other workers may serve a stale GET /api/role/ after a change
+ROLE_CACHE_TTL = int(env.get('ROLE_CACHE_TTL', 30))
+
+# orjson, falls back to json when it is not installed
+JSON_BACKEND = env.get('JSON_BACKEND', 'orjson')
+
+# request threads per worker process, the same default gunicorn.conf.py starts
+THREADS_PER_PAGE = threads_per_worker()
+
+# shed requests with a 503 once a worker has this many in flight, or once they waited this many
+# seconds before reaching it (from ADMISSION_QUEUE_HEADER), lower priority routes are shed earlier. 0 disables
+ADMISSION_MAX_IN_FLIGHT = int(env.get('ADMISSION_MAX_IN_FLIGHT', THREADS_PER_PAGE))
+ADMISSION_MAX_QUEUE_WAIT = float(env.get('ADMISSION_MAX_QUEUE_WAIT', 5))
+ADMISSION_QUEUE_HEADER = env.get('ADMISSION_QUEUE_HEADER', 'X-Request-Start')
+# path prefixes, empty keeps the defaults in admission.py
+ADMISSION_CRITICAL_PATHS = [path for path in env.get('ADMISSION_CRITICAL_PATHS', '').split(',') if path]
+ADMISSION_LOW_PATHS = [path for path in env.get('ADMISSION_LOW_PATHS', '').split(',') if path]
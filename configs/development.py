@@ -1,6 +1,7 @@
 import os
 from os import environ as env
 from dotenv import load_dotenv
+from configs import engine_options, env_bool
 
 # loadenv variable
 load_dotenv()
@@ -19,11 +20,12 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 DATABASE_CONNECT_OPTIONS = {}
 
-# Application threads. A common general assumption is
-# using 2 per available processor cores - to handle
-# incoming requests using one and performing background
-# operations using the other.
-THREADS_PER_PAGE = 2
+# caches, throttling, firebase, startup and admission settings, see configs/common.py
+from configs.common import *
+
+# connection pool, sized from the request threads of each worker
+SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, THREADS_PER_PAGE, DATABASE_CONNECT_OPTIONS,
+  max_overflow=2, pool_timeout=10, statement_timeout=0)
 
 # Enable protection agains *Cross-site Request Forgery (CSRF)*
 CSRF_ENABLED = True
@@ -1,5 +1,6 @@
 from os import environ as env
 from dotenv import load_dotenv
+from configs import engine_options, env_bool
 
 # loadenv variable
 load_dotenv()
@@ -30,11 +31,16 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 DATABASE_CONNECT_OPTIONS = {}
 
-# Application threads. A common general assumption is
-# using 2 per available processor cores - to handle
-# incoming requests using one and performing background
-# operations using the other.
-THREADS_PER_PAGE = 2
+# caches, throttling, firebase, startup and admission settings, see configs/common.py
+from configs.common import *
+
+# bigger cache and shorter firebase timeout than the shared defaults
+SESSION_CACHE_MAX_SIZE = int(env.get('SESSION_CACHE_MAX_SIZE', 4096))
+FIREBASE_HTTP_TIMEOUT = float(env.get('FIREBASE_HTTP_TIMEOUT', 5))
+
+# connection pool, sized from the request threads of each worker
+SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, THREADS_PER_PAGE, DATABASE_CONNECT_OPTIONS,
+  max_overflow=2, pool_timeout=5, pool_recycle=1800, statement_timeout=5000)
 
 # Enable protection agains *Cross-site Request Forgery (CSRF)*
 CSRF_ENABLED = True
@@ -1,6 +1,7 @@
 import os
 from os import environ as env
 from dotenv import load_dotenv
+from configs import engine_options, env_bool
 
 # loadenv variable
 load_dotenv()
@@ -17,11 +18,26 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 DATABASE_CONNECT_OPTIONS = {}
 
-# Application threads. A common general assumption is
-# using 2 per available processor cores - to handle
-# incoming requests using one and performing background
-# operations using the other.
-THREADS_PER_PAGE = 2
+# caches, throttling, firebase, startup and admission settings, see configs/common.py
+from configs.common import *
+
+# tests see every change right away, no caching, throttling, shedding or background threads
+SESSION_CACHE_MAX_SIZE = int(env.get('SESSION_CACHE_MAX_SIZE', 0))
+SESSION_CACHE_TTL = int(env.get('SESSION_CACHE_TTL', 0))
+VERIFY_SESSION_MAX_AGE = int(env.get('VERIFY_SESSION_MAX_AGE', 0))
+NEGATIVE_CACHE_MAX_SIZE = int(env.get('NEGATIVE_CACHE_MAX_SIZE', 0))
+RATE_LIMIT_PER_SECOND = float(env.get('RATE_LIMIT_PER_SECOND', 0))
+BATCH_VERIFY_WORKERS = int(env.get('BATCH_VERIFY_WORKERS', 1)) or None
+REVOCATION_REFRESH_INTERVAL = int(env.get('REVOCATION_REFRESH_INTERVAL', 0))
+KEYSTORE_BACKGROUND_REFRESH = False
+LAZY_INIT = env_bool('LAZY_INIT', False)
+ROLE_CACHE_TTL = int(env.get('ROLE_CACHE_TTL', 0))
+ADMISSION_MAX_IN_FLIGHT = int(env.get('ADMISSION_MAX_IN_FLIGHT', 0))
+ADMISSION_MAX_QUEUE_WAIT = float(env.get('ADMISSION_MAX_QUEUE_WAIT', 0))
+
+# connection pool, sized from the request threads of each worker
+SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, THREADS_PER_PAGE, DATABASE_CONNECT_OPTIONS,
+  max_overflow=0, pool_timeout=5)
 
 # Use a secure, unique and absolutely secret key for
 # signing the data. 
@@ -0,0 +1,22 @@
+'''
+  gunicorn settings, picked up with -c gunicorn.conf.py
+  threaded workers so a request waiting on firebase or postgres doesn't hold the whole worker
+'''
+import os, sys
+from os import environ as env
+
+# gunicorn loads this file by path, make the configs package importable from any cwd
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from configs import threads_per_worker
+
+# processes, each one runs create_app and has its own db pool and caches
+workers = int(env.get('WEB_CONCURRENCY', 2))
+
+# requests served concurrently by each process, also sizes the db pool through THREADS_PER_PAGE
+worker_class = 'gthread'
+threads = threads_per_worker()
+
+# app engine front end keeps connections open, don't drop them between requests
+keepalive = int(env.get('GUNICORN_KEEPALIVE', 75))
+timeout = int(env.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(env.get('GUNICORN_GRACEFUL_TIMEOUT', 20))
@@ -0,0 +1,48 @@
+"""initial schema
+
+Revision ID: 3f9a1c2b7d10
+Revises: 
+Create Date: 2026-10-18 06:31:52.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('roles',
+    sa.Column('role_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('description', sa.String(), nullable=False),
+    sa.Column('level', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('role_id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('users',
+    sa.Column('user_id', sa.String(), nullable=False),
+    sa.Column('email', sa.String(length=128), nullable=False),
+    sa.Column('username', sa.String(length=128), nullable=False),
+    sa.Column('email_verified', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id'),
+    sa.UniqueConstraint('email')
+    )
+    op.create_table('user_role',
+    sa.Column('user_id', sa.String(), nullable=False),
+    sa.Column('role_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['role_id'], ['roles.role_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'role_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_role')
+    op.drop_table('users')
+    op.drop_table('roles')
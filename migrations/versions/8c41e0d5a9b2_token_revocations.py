@@ -0,0 +1,30 @@
+"""token revocations
+
+Revision ID: 8c41e0d5a9b2
+Revises: 3f9a1c2b7d10
+Create Date: 2026-10-18 06:33:07.905361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41e0d5a9b2'
+down_revision = '3f9a1c2b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_revocations',
+    sa.Column('user_id', sa.String(), nullable=False),
+    sa.Column('valid_after', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index(op.f('ix_token_revocations_valid_after'), 'token_revocations', ['valid_after'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_token_revocations_valid_after'), table_name='token_revocations')
+    op.drop_table('token_revocations')
@@ -0,0 +1,25 @@
+"""case insensitive role names
+
+Revision ID: b7e2d94f1a63
+Revises: 8c41e0d5a9b2
+Create Date: 2026-10-18 06:43:58.127640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d94f1a63'
+down_revision = '8c41e0d5a9b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # fails if roles already differ only by case, merge those first
+    op.create_index('ix_roles_lower_name', 'roles', [sa.text('lower(name)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_roles_lower_name', table_name='roles')
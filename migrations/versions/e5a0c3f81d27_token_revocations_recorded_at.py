@@ -0,0 +1,30 @@
+"""token revocations recorded_at
+
+Revision ID: e5a0c3f81d27
+Revises: b7e2d94f1a63
+Create Date: 2026-10-18 07:24:16.530912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a0c3f81d27'
+down_revision = 'b7e2d94f1a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows were written when they were revoked, valid_after is the best guess
+    with op.batch_alter_table('token_revocations') as batch_op:
+        batch_op.add_column(sa.Column('recorded_at', sa.Integer(), nullable=False, server_default='0'))
+    op.execute('UPDATE token_revocations SET recorded_at = valid_after')
+    op.create_index(op.f('ix_token_revocations_recorded_at'), 'token_revocations', ['recorded_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_token_revocations_recorded_at'), table_name='token_revocations')
+    with op.batch_alter_table('token_revocations') as batch_op:
+        batch_op.drop_column('recorded_at')
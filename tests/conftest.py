@@ -0,0 +1,71 @@
+'''
+  shared fixtures, the app runs on configs.testing against a sqlite file and the fake
+  firebase signer from the benchmarks, so nothing here reaches google
+'''
+import os, json
+import pytest
+from benchmarks.fake_firebase import FakeFirebaseSigner
+
+
+@pytest.fixture(scope='session')
+def signer():
+  return FakeFirebaseSigner(project_id='test-project', kid='test-key')
+
+
+@pytest.fixture(scope='session')
+def app(signer, tmp_path_factory):
+  '''one app per test run, firebase_admin only allows one default app per process'''
+  workdir = tmp_path_factory.mktemp('app')
+  key_file = str(workdir / 'keys.json')
+  signer.write_key_file(key_file)
+  os.environ.update({
+    'KEYSTORE_FILE': key_file,
+    'GCLOUD_APP_CRED': json.dumps(signer.service_account()),
+    'TEST_DB_URI': 'sqlite:///' + str(workdir / 'test.db'),
+    'LOG_DIR': str(workdir / 'logs'),
+  })
+  from app import create_app
+
+  return create_app(config_name='configs.testing')
+
+
+@pytest.fixture
+def clean_db(app):
+  '''empty tables with the Admin and User roles, yields the db'''
+  from app import db
+  from app.auth.models import Role
+  from app.auth.registry import role_registry
+
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.add_all([Role('Admin', 'administrator', 10), Role('User', 'base', 0)])
+    db.session.commit()
+    role_registry.invalidate()
+    yield db
+    db.session.remove()
+
+
+@pytest.fixture
+def client(app, clean_db):
+  # explicit Cookie headers only, a cookie jar would replace them
+  return app.test_client(use_cookies=False)
+
+
+# configs.testing turns the caches off, these turn one on for a test
+@pytest.fixture
+def negative_cache(app):
+  from app.auth.controllers import rejected_tokens
+
+  rejected_tokens.configure(64, 300)
+  yield rejected_tokens
+  rejected_tokens.configure(app.config['NEGATIVE_CACHE_MAX_SIZE'], app.config['NEGATIVE_CACHE_TTL'])
+
+
+@pytest.fixture
+def session_cache(app):
+  from app.auth.controllers import session_cache
+
+  session_cache.configure(64, 300)
+  yield session_cache
+  session_cache.configure(app.config['SESSION_CACHE_MAX_SIZE'], app.config['SESSION_CACHE_TTL'])
@@ -0,0 +1,72 @@
+'''
+  end to end through the auth blueprint with tokens and cookies from the fake signer
+'''
+import time
+import jwt
+
+
+def session_header(signer, uid: str, roles):
+  cookie = signer.create_session_cookie(signer.id_token(uid, roles), 3600)
+  return {'Cookie': f'_session_mb={cookie}'}
+
+
+def test_session_login_sets_cookie(client, signer):
+  response = client.post('/api/auth/sessionLogin', json={'token': signer.id_token('u1', ['User'])})
+  assert response.status_code == 200
+  assert '_session_mb=' in response.headers['Set-Cookie']
+
+
+def test_session_login_rejects_bad_token(client):
+  response = client.post('/api/auth/sessionLogin', json={'token': 'not-a-token'})
+  assert response.status_code == 401
+
+
+def test_verify_session_and_etag(client, signer):
+  headers = session_header(signer, 'u1', ['User'])
+  response = client.get('/api/auth/verify_session', headers=headers)
+  assert response.status_code == 200
+  assert response.json['uid'] == 'u1'
+  etag = response.headers['ETag']
+  response = client.get('/api/auth/verify_session', headers={**headers, 'If-None-Match': etag})
+  assert response.status_code == 304
+
+
+def test_verify_session_without_cookie(client):
+  assert client.get('/api/auth/verify_session').status_code == 401
+
+
+def test_verify_token_messages(client, signer, negative_cache):
+  assert client.post('/api/auth/verify_token', json={'token': signer.id_token('u1')}).json == {'message': 'token is valid'}
+  # the second answer comes from the negative cache and must read the same
+  for _ in range(2):
+    assert client.post('/api/auth/verify_token', json={'token': 'garbage'}).json == {'message': 'Invalid Token'}
+
+
+def test_verify_tokens_batch(client, signer):
+  response = client.post('/api/auth/verify_tokens', json={'tokens': [signer.id_token('u1'), 'garbage']})
+  assert response.status_code == 200
+  first, second = response.json['results']
+  assert first['valid'] and first['claims']['uid'] == 'u1'
+  assert second == {'valid': False, 'message': 'Invalid Token'}
+
+
+def test_profile_needs_admin(client, signer):
+  assert client.get('/api/auth/profile', headers=session_header(signer, 'u1', ['User'])).status_code == 403
+  assert client.get('/api/auth/profile', headers=session_header(signer, 'u2', ['Admin'])).status_code == 200
+
+
+def test_rejected_tokens_are_refused_from_the_cache(client, negative_cache):
+  assert client.post('/api/auth/sessionLogin', json={'token': 'garbage'}).status_code == 401
+  assert negative_cache.stats()['size'] == 1
+
+
+def test_token_from_a_clock_ahead_is_not_cached(client, signer, negative_cache):
+  claims = jwt.decode(signer.id_token('u1', ['User']), options={'verify_signature': False})
+  issued = int(time.time()) + 2
+  token = signer._sign({**claims, 'iat': issued, 'auth_time': issued})
+  response = client.post('/api/auth/sessionLogin', json={'token': token})
+  assert response.status_code == 401
+  assert negative_cache.stats()['size'] == 0
+  # once our clock catches up the retry of the same token verifies
+  time.sleep(max(0, issued - time.time()) + 0.5)
+  assert client.post('/api/auth/sessionLogin', json={'token': token}).status_code == 200
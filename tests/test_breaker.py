@@ -0,0 +1,115 @@
+'''
+  circuit breaker state machine and its guard
+'''
+import pytest
+from firebase_admin import auth as fb_auth, exceptions
+from werkzeug.exceptions import ServiceUnavailable
+from app.auth.breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  '''frozen time.monotonic for the breaker, advance with clock.now += seconds'''
+  class Clock:
+    now = 1000.0
+
+  monkeypatch.setattr('app.auth.breaker.time.monotonic', lambda: Clock.now)
+  return Clock
+
+
+def fail(breaker: CircuitBreaker):
+  with pytest.raises(ServiceUnavailable):
+    with breaker.guard():
+      raise exceptions.UnavailableError('down', cause=None)
+
+
+def succeed(breaker: CircuitBreaker):
+  with breaker.guard():
+    pass
+
+
+def test_opens_at_failure_rate_after_min_calls(clock):
+  breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=4, open_seconds=10)
+  succeed(breaker)
+  fail(breaker)
+  fail(breaker)
+  assert breaker.state == CLOSED
+  succeed(breaker)
+  assert breaker.state == OPEN
+
+
+def test_open_breaker_fails_fast_with_retry_after(clock):
+  breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2, open_seconds=10)
+  fail(breaker)
+  fail(breaker)
+  clock.now += 4
+  with pytest.raises(CircuitOpenError) as error:
+    succeed(breaker)
+  assert error.value.code == 503
+  assert error.value.retry_after == 6
+
+
+def test_answers_from_firebase_are_not_failures(clock):
+  breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2)
+  for _ in range(4):
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+      with breaker.guard():
+        raise fb_auth.InvalidIdTokenError('bad token')
+  assert breaker.state == CLOSED
+  assert breaker.stats()['failures'] == 0
+
+
+def test_old_failures_leave_the_window(clock):
+  breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2, window=30)
+  fail(breaker)
+  clock.now += 31
+  succeed(breaker)
+  assert breaker.state == CLOSED
+  assert breaker.stats()['calls'] == 1
+
+
+def test_half_open_probes_close_it(clock):
+  breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2, open_seconds=10, half_open_probes=2)
+  fail(breaker)
+  fail(breaker)
+  clock.now += 10
+  succeed(breaker)
+  assert breaker.state == HALF_OPEN
+  succeed(breaker)
+  assert breaker.state == CLOSED
+
+
+def test_half_open_limits_probes(clock):
+  breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2, open_seconds=10, half_open_probes=1)
+  fail(breaker)
+  fail(breaker)
+  clock.now += 10
+  # the probe is still in flight, nothing else gets through
+  assert breaker.before_call() is True
+  with pytest.raises(CircuitOpenError):
+    breaker.before_call()
+
+
+def test_failed_probe_reopens(clock):
+  breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2, open_seconds=10)
+  fail(breaker)
+  fail(breaker)
+  clock.now += 10
+  fail(breaker)
+  assert breaker.state == OPEN
+  with pytest.raises(CircuitOpenError):
+    succeed(breaker)
+
+
+def test_open_breaker_answers_503_with_retry_after(client, signer):
+  from app.auth.breaker import firebase_verify
+
+  with firebase_verify._lock:
+    firebase_verify._transition(OPEN)
+  try:
+    response = client.post('/api/auth/verify_token', json={'token': signer.id_token('u1')})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+  finally:
+    with firebase_verify._lock:
+      firebase_verify._transition(CLOSED)
@@ -0,0 +1,83 @@
+'''
+  flask app import-users / export-users against sqlite
+'''
+import csv, json
+import pytest
+
+USERS = [
+  {'user_id': 'u1', 'email': 'u1@test.local', 'email_verified': True, 'username': 'one', 'roles': ['Admin', 'User']},
+  {'user_id': 'u2', 'email': 'u2@test.local', 'email_verified': False, 'roles': ['user', 'Missing']},
+  {'user_id': 'u3', 'email': 'u3@test.local'},
+]
+
+
+@pytest.fixture
+def runner(app, clean_db):
+  return app.test_cli_runner()
+
+
+@pytest.fixture
+def ndjson_file(tmp_path):
+  path = tmp_path / 'users.ndjson'
+  path.write_text(''.join(json.dumps(user) + '\n' for user in USERS))
+  return str(path)
+
+
+def last_json(output: str) -> dict:
+  '''the report, printed after any progress lines'''
+  return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_ndjson(runner, ndjson_file):
+  from app.auth.models import User
+
+  result = runner.invoke(args=['app', 'import-users', ndjson_file, '--chunk-size', '2'])
+  assert result.exit_code == 0, result.output
+  report = last_json(result.output)
+  assert (report['read'], report['inserted'], report['skipped']) == (3, 3, 0)
+  # role names match case insensitively, unknown ones are counted and skipped
+  assert (report['role_links'], report['unknown_roles']) == (3, 1)
+  assert User.role_names(['u1', 'u2', 'u3']) == {'u1': ['Admin', 'User'], 'u2': ['User'], 'u3': []}
+
+
+def test_import_is_idempotent(runner, ndjson_file):
+  runner.invoke(args=['app', 'import-users', ndjson_file])
+  result = runner.invoke(args=['app', 'import-users', ndjson_file])
+  assert result.exit_code == 0, result.output
+  report = last_json(result.output)
+  assert (report['inserted'], report['skipped'], report['role_links']) == (0, 3, 0)
+
+
+def test_import_csv(runner, tmp_path):
+  path = tmp_path / 'users.csv'
+  path.write_text('user_id,email,email_verified,username,roles\nc1,c1@test.local,true,,Admin;User\n')
+  result = runner.invoke(args=['app', 'import-users', str(path), '--format', 'csv'])
+  assert result.exit_code == 0, result.output
+  assert last_json(result.output)['role_links'] == 2
+
+
+def test_import_needs_a_source(runner):
+  result = runner.invoke(args=['app', 'import-users'])
+  assert result.exit_code != 0
+
+
+def test_export_round_trips(runner, ndjson_file, tmp_path):
+  runner.invoke(args=['app', 'import-users', ndjson_file])
+  target = tmp_path / 'export.ndjson'
+  result = runner.invoke(args=['app', 'export-users', str(target), '--chunk-size', '2'])
+  assert result.exit_code == 0, result.output
+  assert last_json(result.output)['written'] == 3
+  exported = {record['user_id']: record for record in map(json.loads, target.read_text().splitlines())}
+  assert sorted(exported) == ['u1', 'u2', 'u3']
+  assert exported['u1']['roles'] == ['Admin', 'User']
+  assert exported['u2']['email_verified'] is False
+
+
+def test_export_csv(runner, ndjson_file, tmp_path):
+  runner.invoke(args=['app', 'import-users', ndjson_file])
+  target = tmp_path / 'export.csv'
+  result = runner.invoke(args=['app', 'export-users', str(target), '--format', 'csv'])
+  assert result.exit_code == 0, result.output
+  rows = list(csv.DictReader(target.read_text().splitlines()))
+  assert [row['user_id'] for row in rows] == ['u1', 'u2', 'u3']
+  assert rows[0]['roles'] == 'Admin;User'
@@ -0,0 +1,83 @@
+'''
+  Roles claims sync against a local fake of the firebase admin client
+'''
+import threading
+from types import SimpleNamespace
+import pytest
+from firebase_admin import exceptions
+from app.auth.claims import ClaimsSync
+
+
+class FakeAuthClient:
+  '''get_users and set_custom_user_claims over an in memory user table'''
+  def __init__(self, claims, failures=None):
+    self.claims = {uid: dict(value) for uid, value in claims.items()}
+    # uid -> calls that fail with UnavailableError before one succeeds
+    self.failures = dict(failures or {})
+    self.updates = []
+    self._lock = threading.Lock()
+
+  def get_users(self, identifiers):
+    users = [SimpleNamespace(uid=identifier.uid, custom_claims=self.claims[identifier.uid])
+             for identifier in identifiers if identifier.uid in self.claims]
+    return SimpleNamespace(users=users)
+
+  def set_custom_user_claims(self, uid, claims):
+    with self._lock:
+      if self.failures.get(uid, 0) > 0:
+        self.failures[uid] -= 1
+        raise exceptions.UnavailableError('try again', cause=None)
+      self.claims[uid] = claims
+      self.updates.append(uid)
+
+
+def test_diff_only_changed_users_keeps_other_claims():
+  sync = ClaimsSync(client=None)
+  db_roles = {'u1': ['Admin', 'User'], 'u2': ['User'], 'u3': []}
+  claims = {'u1': {'Roles': ['User', 'Admin'], 'tier': 'gold'}, 'u2': {'Roles': ['Admin'], 'tier': 'free'}}
+  assert sync.diff(db_roles, claims) == [('u2', {'Roles': ['User'], 'tier': 'free'})]
+
+
+def test_run_pushes_changes_and_reports():
+  client = FakeAuthClient({'u1': {'Roles': ['User']}, 'u2': {'Roles': ['User']}, 'u3': {}})
+  sync = ClaimsSync(client=client, workers=2)
+  pages = [{'u1': ['User'], 'u2': ['Admin']}, {'u3': ['User'], 'u4': ['User']}]
+  report = sync.run(iter(pages))
+  assert sorted(client.updates) == ['u2', 'u3']
+  assert client.claims['u2'] == {'Roles': ['Admin']}
+  assert report.to_dict()['scanned'] == 4
+  assert (report.changed, report.updated, report.missing, report.failed) == (2, 2, 1, 0)
+
+
+def test_dry_run_pushes_nothing():
+  client = FakeAuthClient({'u1': {'Roles': []}})
+  report = ClaimsSync(client=client, dry_run=True).run(iter([{'u1': ['Admin']}]))
+  assert report.changed == 1 and client.updates == []
+
+
+def test_transient_errors_are_retried():
+  client = FakeAuthClient({'u1': {}}, failures={'u1': 2})
+  report = ClaimsSync(client=client, backoff=0, max_retries=3).run(iter([{'u1': ['User']}]))
+  assert (report.updated, report.retries, report.failed) == (1, 2, 0)
+
+
+def test_failures_are_reported_after_max_retries():
+  client = FakeAuthClient({'u1': {}, 'u2': {}}, failures={'u1': 5})
+  report = ClaimsSync(client=client, backoff=0, max_retries=1).run(iter([{'u1': ['User'], 'u2': ['User']}]))
+  assert (report.updated, report.failed) == (1, 1)
+  assert [user_id for user_id, _ in report.failures] == ['u1']
+
+
+def test_sync_from_user_role_table(clean_db):
+  from app.auth.models import User, Role
+  from app.auth.claims import iter_db_roles
+
+  admin = Role.query.filter_by(name='Admin').one()
+  user = User(user_id='u1', email='u1@test.local', email_verified=True)
+  user.roles.append(admin)
+  clean_db.session.add_all([user, User(user_id='u2', email='u2@test.local', email_verified=True)])
+  clean_db.session.commit()
+  client = FakeAuthClient({'u1': {}, 'u2': {'Roles': ['Admin']}})
+  report = ClaimsSync(client=client).run(iter_db_roles(chunk_size=1))
+  assert client.claims == {'u1': {'Roles': ['Admin']}, 'u2': {'Roles': []}}
+  assert report.updated == 2
@@ -0,0 +1,175 @@
+'''
+  signing key store, loaded from files so nothing is fetched from google
+'''
+import json
+import pytest
+from app.auth.keystore import SigningKeyStore, KeyStoreRequest, ID_TOKEN_CERT_URI, COOKIE_CERT_URI
+
+
+@pytest.fixture
+def key_file(tmp_path):
+  path = tmp_path / 'keys.json'
+  path.write_text(json.dumps({
+    'id_token': {'kid-1': 'pem-1'},
+    'session_cookie': {'kid-2': 'pem-2'},
+    'https://example.com/certs': {'kid-3': 'pem-3'},
+  }))
+  return str(path)
+
+
+def test_load_file_maps_names_to_urls(key_file):
+  store = SigningKeyStore()
+  store.load_file(key_file)
+  assert store.get_keys(ID_TOKEN_CERT_URI) == {'kid-1': 'pem-1'}
+  assert store.get_keys(COOKIE_CERT_URI) == {'kid-2': 'pem-2'}
+  assert store.get_keys('https://example.com/certs') == {'kid-3': 'pem-3'}
+  assert json.loads(store.get_raw(ID_TOKEN_CERT_URI)) == {'kid-1': 'pem-1'}
+
+
+def test_loaded_keys_never_refresh(key_file):
+  store = SigningKeyStore()
+  store.load_file(key_file)
+  assert store.next_refresh() == float('inf')
+
+
+def test_request_serves_keys_from_memory(key_file):
+  calls = []
+  store = SigningKeyStore(fetch_timeout=3)
+  store.load_file(key_file)
+  request = KeyStoreRequest(store, lambda url, **kwargs: calls.append((url, kwargs)))
+  response = request(ID_TOKEN_CERT_URI)
+  assert response.status == 200
+  assert json.loads(response.data) == {'kid-1': 'pem-1'}
+  assert calls == []
+
+
+def test_request_falls_back_with_store_timeout(key_file):
+  calls = []
+  store = SigningKeyStore(fetch_timeout=3)
+  store.load_file(key_file)
+  request = KeyStoreRequest(store, lambda url, **kwargs: calls.append((url, kwargs)))
+  request('https://example.com/other')
+  request(ID_TOKEN_CERT_URI, method='POST')
+  assert [url for url, _ in calls] == ['https://example.com/other', ID_TOKEN_CERT_URI]
+  assert all(kwargs['timeout'] == 3 for _, kwargs in calls)
+
+
+def test_merge_serves_source_keys_own_keys_win(key_file):
+  store = SigningKeyStore()
+  store.load_file(key_file)
+  store.set_keys('https://example.com/sa', {'kid-sa': 'pem-sa', 'kid-2': 'other'})
+  store.merge(COOKIE_CERT_URI, 'https://example.com/sa')
+  assert json.loads(store.get_raw(COOKIE_CERT_URI)) == {'kid-sa': 'pem-sa', 'kid-2': 'pem-2'}
+  assert store.has_key(COOKIE_CERT_URI, 'kid-sa')
+  assert not store.has_key(ID_TOKEN_CERT_URI, 'kid-sa')
+  # a refresh of the source shows up in the target
+  store.set_keys('https://example.com/sa', {'kid-new': 'pem-new'})
+  assert store.has_key(COOKIE_CERT_URI, 'kid-new') and not store.has_key(COOKIE_CERT_URI, 'kid-sa')
+
+
+def test_failed_refresh_keeps_keys(key_file, monkeypatch):
+  store = SigningKeyStore(urls={'id_token': ID_TOKEN_CERT_URI}, retry_after=30)
+  store.load_file(key_file)
+
+  def fail(url):
+    raise ConnectionError('offline')
+
+  monkeypatch.setattr(store, 'fetch', fail)
+  assert store.refresh(force=True) is False
+  assert store.refresh_failures == 1
+  assert store.get_keys(ID_TOKEN_CERT_URI) == {'kid-1': 'pem-1'}
+  assert store.next_refresh() < float('inf')
+
+
+def test_firebase_verifies_against_the_store(app, signer):
+  from firebase_admin import auth as fb_auth
+
+  with app.app_context():
+    claims = fb_auth.verify_id_token(signer.id_token('u1', ['User']))
+  assert claims['uid'] == 'u1'
+  assert claims['Roles'] == ['User']
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  '''frozen time.monotonic for refetches, advance with clock.now += seconds'''
+  class Clock:
+    now = 100.0
+
+  monkeypatch.setattr('app.auth.keystore.time.monotonic', lambda: Clock.now)
+  return Clock
+
+
+def fetching_store(monkeypatch, keys, **kwargs):
+  '''store whose fetch serves keys[url] and records the urls fetched'''
+  store = SigningKeyStore(**kwargs)
+  store.fetched = []
+
+  def fetch(url):
+    store.fetched.append(url)
+    store.set_keys(url, keys[url], 3600)
+
+  monkeypatch.setattr(store, 'fetch', fetch)
+  return store
+
+
+def test_unknown_kid_is_refetched_once_per_interval(monkeypatch, clock):
+  keys = {ID_TOKEN_CERT_URI: {'kid-1': 'pem-1'}}
+  store = fetching_store(monkeypatch, keys, refetch_interval=10)
+  store.set_keys(ID_TOKEN_CERT_URI, {'kid-0': 'pem-0'}, 3600)
+  assert store.ensure_key(ID_TOKEN_CERT_URI, 'kid-1')
+  assert store.ensure_key(ID_TOKEN_CERT_URI, 'kid-1')
+  assert not store.ensure_key(ID_TOKEN_CERT_URI, 'made-up')
+  assert store.fetched == [ID_TOKEN_CERT_URI]
+  clock.now += 10
+  assert not store.ensure_key(ID_TOKEN_CERT_URI, 'made-up')
+  assert store.fetched == [ID_TOKEN_CERT_URI] * 2
+
+
+def test_refetch_covers_merged_sources(monkeypatch, clock):
+  keys = {COOKIE_CERT_URI: {'kid-2': 'pem-2'}, 'https://example.com/sa': {'kid-sa': 'pem-sa'}}
+  store = fetching_store(monkeypatch, keys)
+  store.merge(COOKIE_CERT_URI, 'https://example.com/sa', name='service_account')
+  assert store.ensure_key(COOKIE_CERT_URI, 'kid-sa')
+  assert store.fetched == [COOKIE_CERT_URI, 'https://example.com/sa']
+
+
+def test_keys_from_a_file_are_never_refetched(monkeypatch, key_file):
+  store = fetching_store(monkeypatch, {}, refetch_interval=None)
+  store.load_file(key_file)
+  assert not store.ensure_key(ID_TOKEN_CERT_URI, 'kid-x')
+  assert store.fetched == []
+
+
+def test_verify_retries_after_refetch(monkeypatch, clock, signer):
+  from google.auth import jwt as google_jwt
+
+  token = signer.id_token('u1')
+  keys = {ID_TOKEN_CERT_URI: {'test-key': 'pem'}}
+  store = fetching_store(monkeypatch, keys)
+
+  def verify(token):
+    kid = google_jwt.decode_header(token)['kid']
+    if not store.has_key(ID_TOKEN_CERT_URI, kid):
+      raise ValueError(f'Certificate for key id {kid} not found.')
+    return {'uid': 'u1'}
+
+  assert store.verify(ID_TOKEN_CERT_URI, verify, token) == {'uid': 'u1'}
+  assert store.fetched == [ID_TOKEN_CERT_URI]
+
+
+def test_service_account_certs_are_trusted_without_local_signing(app, monkeypatch):
+  import firebase_admin
+  from urllib.parse import quote
+  from app.auth import keystore, cookie_signer as signer_module
+
+  store = SigningKeyStore()
+  signer = signer_module.SessionCookieSigner()
+  monkeypatch.setattr(keystore, 'key_store', store)
+  monkeypatch.setattr(signer_module, 'cookie_signer', signer)
+  fb_app = firebase_admin.get_app()
+  assert signer_module.setup_cookie_signer(fb_app, fetch_certs=False, local_signing=False) is False
+  assert not signer.ready
+  email = fb_app.credential.get_credential().service_account_email
+  store.set_keys(signer_module.SERVICE_ACCOUNT_CERT_URI.format(quote(email)), {'sa-kid': 'pem'})
+  assert store.has_key(COOKIE_CERT_URI, 'sa-kid')
@@ -0,0 +1,16 @@
+'''
+  /metrics exposes the auth caches, limiter, key store and revocation index
+'''
+
+
+def test_auth_state_is_exported(client, signer):
+  for _ in range(2):
+    client.post('/api/auth/verify_token', json={'token': 'garbage'})
+  text = client.get('/metrics').get_data(as_text=True)
+  for name in ('auth_cache_size{cache="session"}', 'auth_cache_max_size{cache="rejected_tokens"}',
+               'auth_cache_hits{cache="rejected_tokens"}', 'auth_cache_misses{cache="session"}',
+               'auth_cache_evictions{cache="session"}', 'rate_limit_rejected ',
+               'signing_keys{url="https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"} 1',
+               'signing_keys_next_refresh ', 'signing_keys_refresh_failures ',
+               'revocation_index_size ', 'revocation_index_watermark '):
+    assert name in text, name
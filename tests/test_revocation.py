@@ -0,0 +1,115 @@
+'''
+  revocation index, the token_revocations table it refreshes from, and the ways rows get there
+'''
+import time
+from types import SimpleNamespace
+import pytest
+from app.auth.revocation import RevocationIndex, sync_revocations
+from app.auth.models import TokenRevocation
+
+
+class FakeUsersClient:
+  '''list_users over a fixed list of users'''
+  def __init__(self, users):
+    self.users = users
+
+  def list_users(self, max_results):
+    return SimpleNamespace(iterate_all=lambda: iter(self.users))
+
+
+def firebase_user(uid: str, created: int, valid_after: int):
+  return SimpleNamespace(uid=uid, tokens_valid_after_timestamp=valid_after * 1000,
+                         user_metadata=SimpleNamespace(creation_timestamp=created * 1000))
+
+
+def test_is_revoked_compares_iat():
+  index = RevocationIndex()
+  # nothing to refresh from, record applies right away
+  index._next_refresh = float('inf')
+  index.record('u1', 1000)
+  assert index.is_revoked({'uid': 'u1', 'iat': 999})
+  assert not index.is_revoked({'uid': 'u1', 'iat': 1000})
+  assert index.is_revoked({'sub': 'u1', 'iat': 500})
+  assert not index.is_revoked({'uid': 'u2', 'iat': 1})
+  # never moves back
+  index.record('u1', 10)
+  assert index.is_revoked({'uid': 'u1', 'iat': 999})
+
+
+def test_refresh_loads_rows_written_elsewhere(clean_db):
+  now = int(time.time())
+  index = RevocationIndex(refresh_interval=0)
+  TokenRevocation.record('u1', now)
+  assert index.is_revoked({'uid': 'u1', 'iat': now - 1})
+  TokenRevocation.record('u2', now)
+  assert index.is_revoked({'uid': 'u2', 'iat': now - 1})
+
+
+def test_refresh_skips_revocations_older_than_max_age(clean_db):
+  now = int(time.time())
+  TokenRevocation.record('old', now - 100)
+  index = RevocationIndex(refresh_interval=0, max_age=50)
+  index.refresh(force=True)
+  assert index.stats()['size'] == 0
+
+
+def test_backdated_revocation_after_a_newer_one_is_loaded(clean_db):
+  '''a synced firebase revocation carries a past valid_after but is still picked up'''
+  now = int(time.time())
+  index = RevocationIndex(refresh_interval=0)
+  TokenRevocation.record('A', now)
+  index.refresh(force=True)
+  TokenRevocation.record('B', now - 1200)
+  index.refresh(force=True)
+  assert index.is_revoked({'uid': 'B', 'iat': now - 1800})
+
+
+def test_record_moves_valid_after_forward_only(clean_db):
+  TokenRevocation.record('u1', 200)
+  TokenRevocation.record('u1', 100)
+  assert [row[:2] for row in TokenRevocation.since(0)] == [('u1', 200)]
+  TokenRevocation.record('u1', 300)
+  assert [row[:2] for row in TokenRevocation.since(0)] == [('u1', 300)]
+
+
+def test_sync_revocations_copies_only_revoked_users(clean_db):
+  now = int(time.time())
+  client = FakeUsersClient([
+    # valid_after at creation is not a revocation
+    firebase_user('fresh', now - 100, now - 100),
+    firebase_user('revoked', now - 5000, now - 1200),
+    # revoked before any live session could have been issued
+    firebase_user('ancient', now - 90 * 86400, now - 60 * 86400),
+  ])
+  assert sync_revocations(max_age=14 * 86400, client=client) == {'synced': 1}
+  assert [row[:2] for row in TokenRevocation.since(0)] == [('revoked', now - 1200)]
+
+
+def test_revoke_endpoint_rejects_older_sessions(client, signer, monkeypatch, session_cache):
+  from app.auth import controllers
+  from app.auth.controllers import hash_secret
+
+  valid_after = int(time.time()) + 5
+  calls = []
+  monkeypatch.setattr(controllers.fb_auth, 'revoke_refresh_tokens', calls.append)
+  monkeypatch.setattr(controllers.fb_auth, 'get_user',
+    lambda uid: SimpleNamespace(uid=uid, tokens_valid_after_timestamp=valid_after * 1000))
+  victim = signer.create_session_cookie(signer.id_token('victim', ['User']), 3600)
+  admin = signer.create_session_cookie(signer.id_token('admin', ['Admin']), 3600)
+  assert client.get('/api/auth/verify_session', headers={'Cookie': f'_session_mb={victim}'}).status_code == 200
+  assert session_cache.get(hash_secret(victim)) is not None
+
+  response = client.post('/api/user/victim/revoke', headers={'Cookie': f'_session_mb={admin}'})
+  assert response.status_code == 200
+  assert response.json['valid_after'] == valid_after
+  assert calls == ['victim']
+  assert [row[:2] for row in TokenRevocation.since(0)] == [('victim', valid_after)]
+  # the cached verification is dropped along with the session
+  assert session_cache.get(hash_secret(victim)) is None
+  response = client.get('/api/auth/verify_session', headers={'Cookie': f'_session_mb={victim}'})
+  assert response.status_code == 401
+
+
+def test_revoke_endpoint_needs_admin(client, signer):
+  user = signer.create_session_cookie(signer.id_token('u1', ['User']), 3600)
+  assert client.post('/api/user/u2/revoke', headers={'Cookie': f'_session_mb={user}'}).status_code == 403
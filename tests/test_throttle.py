@@ -0,0 +1,87 @@
+'''
+  per client token bucket on the token endpoints
+'''
+import pytest
+from app.auth.throttle import TokenBucketLimiter, retry_after_seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  '''frozen time.monotonic for the limiter, advance with clock.now += seconds'''
+  class Clock:
+    now = 100.0
+
+  monkeypatch.setattr('app.auth.throttle.time.monotonic', lambda: Clock.now)
+  return Clock
+
+
+def test_burst_then_wait(clock):
+  limiter = TokenBucketLimiter(rate=2, burst=3)
+  assert [limiter.allow('a') for _ in range(3)] == [0, 0, 0]
+  assert limiter.allow('a') == pytest.approx(0.5)
+  assert limiter.rejected == 1
+  # other clients have their own bucket
+  assert limiter.allow('b') == 0
+
+
+def test_bucket_refills_up_to_burst(clock):
+  limiter = TokenBucketLimiter(rate=2, burst=3)
+  for _ in range(3):
+    limiter.allow('a')
+  clock.now += 0.5
+  assert limiter.allow('a') == 0
+  assert limiter.allow('a') > 0
+  clock.now += 60
+  assert [limiter.allow('a') for _ in range(4)][:3] == [0, 0, 0]
+
+
+def test_cost_is_charged_in_full(clock):
+  limiter = TokenBucketLimiter(rate=1, burst=10)
+  assert limiter.allow('a', 4) == 0
+  assert limiter.allow('a', 7) == pytest.approx(1)
+  assert limiter.allow('a', 6) == 0
+
+
+def test_cost_above_burst_leaves_debt(clock):
+  limiter = TokenBucketLimiter(rate=1, burst=10)
+  assert limiter.allow('a', 25) == 0
+  # 15 tokens of debt plus one for the next request
+  assert limiter.allow('a') == pytest.approx(16)
+  clock.now += 16
+  assert limiter.allow('a') == 0
+
+
+def test_zero_rate_disables(clock):
+  limiter = TokenBucketLimiter(rate=0, burst=0)
+  assert all(limiter.allow('a', 100) == 0 for _ in range(10))
+
+
+def test_only_max_clients_are_tracked(clock):
+  limiter = TokenBucketLimiter(rate=1, burst=1, max_clients=2)
+  for client in ('a', 'b', 'c'):
+    limiter.allow(client)
+  # a was evicted and starts with a full bucket
+  assert limiter.allow('a') == 0
+  assert limiter.allow('c') > 0
+
+
+def test_retry_after_rounds_up():
+  assert retry_after_seconds(0.2) == 1
+  assert retry_after_seconds(2.1) == 3
+
+
+def test_verify_tokens_charges_per_token(app, client, signer):
+  from app.auth.throttle import token_limiter
+
+  token = signer.id_token('u1')
+  token_limiter.configure(rate=0.001, burst=5, max_clients=10)
+  try:
+    assert client.post('/api/auth/verify_tokens', json={'tokens': [token] * 4}).status_code == 200
+    response = client.post('/api/auth/verify_tokens', json={'tokens': [token] * 2})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    # malformed batches are refused before they are charged
+    assert client.post('/api/auth/verify_tokens', json={'tokens': []}).status_code == 400
+  finally:
+    token_limiter.configure(app.config['RATE_LIMIT_PER_SECOND'], app.config['RATE_LIMIT_BURST'],
+                            app.config['RATE_LIMIT_MAX_CLIENTS'])
@@ -0,0 +1,68 @@
+'''
+  TTLCache behind the session cache and the rejected token cache
+'''
+import pytest
+from app.auth.controllers import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  '''frozen time.time for the cache, advance with clock.now += seconds'''
+  class Clock:
+    now = 1000.0
+
+  monkeypatch.setattr('app.auth.controllers.time.time', lambda: Clock.now)
+  return Clock
+
+
+def test_get_set_counts_hits_and_misses():
+  cache = TTLCache(max_size=4, ttl=60)
+  assert cache.get('a') is None
+  cache.set('a', 1)
+  assert cache.get('a') == 1
+  assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+  cache = TTLCache(max_size=4, ttl=60)
+  cache.set('a', 1)
+  clock.now += 59
+  assert cache.get('a') == 1
+  clock.now += 1
+  assert cache.get('a') is None
+  assert cache.stats()['size'] == 0
+
+
+def test_entries_never_outlive_expires_at(clock):
+  cache = TTLCache(max_size=4, ttl=60)
+  cache.set('a', 1, expires_at=clock.now + 10)
+  clock.now += 10
+  assert cache.get('a') is None
+
+
+def test_least_recently_used_is_evicted():
+  cache = TTLCache(max_size=2, ttl=60)
+  cache.set('a', 1)
+  cache.set('b', 2)
+  # touching a makes b the oldest
+  cache.get('a')
+  cache.set('c', 3)
+  assert cache.get('b') is None
+  assert cache.get('a') == 1 and cache.get('c') == 3
+  assert cache.stats()['evictions'] == 1
+
+
+def test_zero_size_disables_the_cache():
+  cache = TTLCache(max_size=0, ttl=60)
+  cache.set('a', 1)
+  assert cache.get('a') is None
+
+
+def test_invalidate_where():
+  cache = TTLCache(max_size=4, ttl=60)
+  cache.set('a', {'uid': 'u1'})
+  cache.set('b', {'uid': 'u2'})
+  cache.set('c', {'uid': 'u1'})
+  assert cache.invalidate_where(lambda value: value['uid'] == 'u1') == 2
+  assert cache.get('b') == {'uid': 'u2'}
+  assert cache.invalidate('b') and not cache.invalidate('b')